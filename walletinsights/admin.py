@@ -0,0 +1,25 @@
+from django.contrib import admin
+
+from .models import Owner, OwnerSyncStats
+
+
+class OwnerSyncStatsInline(admin.TabularInline):
+    model = OwnerSyncStats
+    extra = 0
+    can_delete = False
+    readonly_fields = [field.name for field in OwnerSyncStats._meta.fields if field.name != "id"]
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Owner)
+class OwnerAdmin(admin.ModelAdmin):
+    list_display = ("corp", "is_active", "balances_last_updated", "backfill_progress")
+    list_filter = ("is_active",)
+    list_select_related = ("corp",)
+    readonly_fields = (
+        "corp", "balances_last_updated", "backfill_started", "backfill_finished", "backfill_updated",
+        "backfill_pages_done", "backfill_pages_total"
+    )
+    inlines = [OwnerSyncStatsInline]
@@ -0,0 +1,61 @@
+from allianceauth.notifications import notify
+from django.contrib.auth.models import Permission, User
+from django.db.models import Q
+
+from .models import RefType
+
+ALERT_PERMISSION = "outflow_alerts"
+# Entries listed in a single notification, the rest are summarised.
+MAX_ALERT_ENTRIES = 10
+
+
+def alert_recipients(owner):
+    """
+    Active users with the outflow_alerts permission who can see the wallet of the owner.
+    :param owner:
+    :return: list of Users
+    """
+    permission = Permission.objects.get(content_type__app_label="walletinsights", codename=ALERT_PERMISSION)
+    users = (
+        User.objects
+        .filter(is_active=True)
+        .filter(
+            Q(user_permissions=permission)
+            | Q(groups__permissions=permission)
+            | Q(profile__state__permissions=permission)
+        )
+        .select_related("profile__main_character")
+        .distinct()
+    )
+    recipients = []
+    for user in users:
+        main = user.profile.main_character
+        if user.has_perm("walletinsights.all_corp_access") or (
+            main is not None and main.corporation_id == owner.corp.corporation_id
+        ):
+            recipients.append(user)
+    return recipients
+
+
+def notify_outflows(division, entries):
+    """
+    Notify the alert recipients of the owner about unusual outflows of a division.
+    :param division: WalletDivision, with corp and corp.corp loaded.
+    :param entries: list of WalletJournalEntry.
+    :return: number of users notified.
+    """
+    if not entries:
+        return 0
+    title = f"Unusual outflow from {division.corp.corp.corporation_name} - {division.division_name}"
+    lines = [
+        f"{entry.date:%Y-%m-%d %H:%M} {RefType.objects.name_for(entry.ref_type_id)}: {entry.amount:,.2f} ISK. {entry.description}"
+        for entry in entries[:MAX_ALERT_ENTRIES]
+    ]
+    if len(entries) > MAX_ALERT_ENTRIES:
+        lines.append(f"and {len(entries) - MAX_ALERT_ENTRIES} more.")
+    message = "\n".join(lines)
+
+    recipients = alert_recipients(division.corp)
+    for user in recipients:
+        notify(user, title, message, level="warning")
+    return len(recipients)
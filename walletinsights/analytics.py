@@ -0,0 +1,136 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db.models import Sum
+from django.utils.timezone import localdate
+
+from .app_settings import WALLETINSIGHTS_ANALYTICS_CACHE_TTL, WALLETINSIGHTS_EXPORT_CHUNK_SIZE
+from .models import WalletDivision, WalletJournalDailyRollup
+from .reports import month_cache_keys
+
+COLUMNS = ("income", "expense", "tax")
+
+
+def _months(start, end):
+    month = start.replace(day=1)
+    while month <= end:
+        yield month
+        month = (month + timedelta(days=32)).replace(day=1)
+
+
+def _month_end(month):
+    return (month + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+
+
+def _load_daily_totals(owner, start, end, chunk_size=WALLETINSIGHTS_EXPORT_CHUNK_SIZE):
+    """
+    Income, expense and tax per day of an owner, summed over divisions and ref types.
+    Rollup columns are pulled in pk ordered chunks straight into float64 and datetime64 arrays.
+    """
+    import numpy as np
+    import pandas as pd
+
+    queryset = (
+        WalletJournalDailyRollup.objects
+        .filter(division__corp=owner, day__gte=start, day__lte=end)
+        .order_by("pk")
+        .values_list("pk", "day", *COLUMNS)
+    )
+    frames = []
+    last_pk = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+        _, days, income, expense, tax = zip(*rows)
+        frames.append(pd.DataFrame({
+            "day": np.array(days, dtype="datetime64[D]").astype("datetime64[ns]"),
+            "income": np.array(income, dtype=np.float64),
+            "expense": np.array(expense, dtype=np.float64),
+            "tax": np.array(tax, dtype=np.float64),
+        }))
+        if len(rows) < chunk_size:
+            break
+    if not frames:
+        return pd.DataFrame(columns=list(COLUMNS), index=pd.DatetimeIndex([], name="day"), dtype=np.float64)
+    return pd.concat(frames, ignore_index=True).groupby("day").sum()
+
+
+def daily_totals(owner, start, end):
+    """
+    Income, expense, tax and net of an owner for every day from start to end, as a pandas DataFrame.
+    The days are cached in monthly pieces, and only the months that received new journal rows
+    since they were cached are loaded again.
+    Requires numpy and pandas, install with walletinsights[analytics].
+    :param owner:
+    :param start: first day.
+    :param end: last day.
+    :return: DataFrame indexed by day.
+    """
+    import pandas as pd
+
+    months = list(_months(start, end))
+    keys = month_cache_keys("daily_totals", owner.pk, months)
+    cached = cache.get_many(keys.values())
+    pieces = {month: cached[key] for month, key in keys.items() if key in cached}
+    stale = [month for month in months if month not in pieces]
+    if stale:
+        # One query for the whole stale span, fresh months inside it are reloaded too.
+        loaded = _load_daily_totals(owner, stale[0], _month_end(stale[-1]))
+        for month in stale:
+            pieces[month] = loaded.loc[pd.Timestamp(month):pd.Timestamp(_month_end(month))]
+        cache.set_many({keys[month]: pieces[month] for month in stale}, timeout=WALLETINSIGHTS_ANALYTICS_CACHE_TTL)
+
+    frame = pd.concat([pieces[month] for month in months])
+    frame = frame.reindex(pd.date_range(start, end, freq="D", name="day"), fill_value=0.0)
+    frame["net"] = frame["income"] + frame["expense"]
+    return frame
+
+
+def monthly_pnl(owner, start, end):
+    """
+    Income, expense, tax and net of an owner per calendar month.
+    :return: list of dicts with month, income, expense, tax and net.
+    """
+    monthly = daily_totals(owner, start, end).resample("MS").sum()
+    return [
+        {"month": month.date(), **{column: float(value) for column, value in row.items()}}
+        for month, row in monthly.iterrows()
+    ]
+
+
+def moving_averages(owner, start, end, window=30):
+    """
+    Daily net flow of an owner with its moving average over the previous window days.
+    :return: list of dicts with day, net and average.
+    """
+    frame = daily_totals(owner, start - timedelta(days=window - 1), end)
+    averages = frame["net"].rolling(window, min_periods=1).mean()
+    frame = frame.assign(average=averages).loc[str(start):]
+    return [
+        {"day": day.date(), "net": float(net), "average": float(average)}
+        for day, net, average in zip(frame.index, frame["net"], frame["average"])
+    ]
+
+
+def cashflow_forecast(owner, days=30, history=90):
+    """
+    Projects the balance of an owner by fitting a linear trend to its daily net flow over the last history days.
+    :param owner:
+    :param days: days to project.
+    :param history: days of history to fit.
+    :return: list of dicts with day, net and balance.
+    """
+    import numpy as np
+
+    today = localdate()
+    nets = daily_totals(owner, today - timedelta(days=history), today - timedelta(days=1))["net"].to_numpy()
+    slope, intercept = np.polyfit(np.arange(len(nets)), nets, 1) if len(nets) > 1 else (0.0, float(nets.sum()))
+    projected = intercept + slope * np.arange(len(nets), len(nets) + days)
+    balance = WalletDivision.objects.filter(corp=owner).aggregate(total=Sum("balance"))["total"] or 0
+    balances = float(balance) + np.cumsum(projected)
+    return [
+        {"day": today + timedelta(days=i), "net": float(net), "balance": float(projected_balance)}
+        for i, (net, projected_balance) in enumerate(zip(projected, balances))
+    ]
@@ -0,0 +1,81 @@
+from django.conf import settings
+
+# Number of journal rows looked up and inserted per query while ingesting ESI data.
+WALLETINSIGHTS_JOURNAL_BATCH_SIZE = getattr(settings, "WALLETINSIGHTS_JOURNAL_BATCH_SIZE", 1000)
+
+# Seconds an ESI ETag is kept in the cache after its response expires. Entries older than this are evicted.
+WALLETINSIGHTS_ESI_ETAG_TTL = getattr(settings, "WALLETINSIGHTS_ESI_ETAG_TTL", 60 * 60 * 24 * 7)
+
+# Seconds a rendered owner card is cached on the dashboard. Cards are also invalidated whenever an owner syncs.
+WALLETINSIGHTS_DASHBOARD_CACHE_TTL = getattr(settings, "WALLETINSIGHTS_DASHBOARD_CACHE_TTL", 60 * 60)
+
+# Seconds over which update_all_owners spreads the owner syncs. Should match the beat schedule of the task.
+WALLETINSIGHTS_SYNC_INTERVAL = getattr(settings, "WALLETINSIGHTS_SYNC_INTERVAL", 60 * 60)
+
+# Stop sending ESI requests until the error window resets once this few errors remain.
+WALLETINSIGHTS_ESI_ERROR_LIMIT_THRESHOLD = getattr(settings, "WALLETINSIGHTS_ESI_ERROR_LIMIT_THRESHOLD", 20)
+
+# Maximum ESI requests in flight across all workers, and for a single token.
+WALLETINSIGHTS_ESI_MAX_CONCURRENT_REQUESTS = getattr(settings, "WALLETINSIGHTS_ESI_MAX_CONCURRENT_REQUESTS", 20)
+WALLETINSIGHTS_ESI_MAX_CONCURRENT_REQUESTS_PER_TOKEN = getattr(
+    settings, "WALLETINSIGHTS_ESI_MAX_CONCURRENT_REQUESTS_PER_TOKEN", 4
+)
+
+# Threads used to fetch journal pages concurrently for an owner. Kept below the per token request cap,
+# so the balance sync and backfill running alongside under the same token still find a free request slot.
+WALLETINSIGHTS_ESI_JOURNAL_WORKERS = max(1, min(
+    getattr(settings, "WALLETINSIGHTS_ESI_JOURNAL_WORKERS", WALLETINSIGHTS_ESI_MAX_CONCURRENT_REQUESTS_PER_TOKEN - 1),
+    WALLETINSIGHTS_ESI_MAX_CONCURRENT_REQUESTS_PER_TOKEN - 1
+))
+
+# Number of journal rows read per query when exporting.
+WALLETINSIGHTS_EXPORT_CHUNK_SIZE = getattr(settings, "WALLETINSIGHTS_EXPORT_CHUNK_SIZE", 5000)
+
+# Days journal entries stay in the main journal table before archive_journal_entries moves them
+# to the archive table. None keeps every entry in the main table.
+WALLETINSIGHTS_JOURNAL_RETENTION_DAYS = getattr(settings, "WALLETINSIGHTS_JOURNAL_RETENTION_DAYS", None)
+
+# Bearer token required to scrape the Prometheus metrics endpoint. The endpoint is disabled while this is None.
+WALLETINSIGHTS_METRICS_TOKEN = getattr(settings, "WALLETINSIGHTS_METRICS_TOKEN", None)
+
+# Days after which balance records are downsampled to the last record of each day. None keeps every record.
+WALLETINSIGHTS_BALANCE_COMPACT_AFTER_DAYS = getattr(settings, "WALLETINSIGHTS_BALANCE_COMPACT_AFTER_DAYS", None)
+
+# Seconds analytics results are cached. Results are also invalidated as soon as new journal rows are synced.
+WALLETINSIGHTS_ANALYTICS_CACHE_TTL = getattr(settings, "WALLETINSIGHTS_ANALYTICS_CACHE_TTL", 60 * 60 * 24)
+
+# Seconds a name resolved through ESI is used before it is resolved again.
+WALLETINSIGHTS_NAME_TTL = getattr(settings, "WALLETINSIGHTS_NAME_TTL", 60 * 60 * 24 * 30)
+
+# Seconds a per-owner sync lock is held at most. A run still going after this long no longer blocks new runs.
+WALLETINSIGHTS_SYNC_LOCK_TIMEOUT = getattr(settings, "WALLETINSIGHTS_SYNC_LOCK_TIMEOUT", 60 * 30)
+
+# Outflows more than this many standard deviations above the usual outflow of their division and ref type
+# raise an alert. Deviations are measured on a log scale, so 3 means about a thousand times the usual amount
+# for a ref type whose amounts vary by a factor of ten.
+WALLETINSIGHTS_OUTFLOW_ALERT_THRESHOLD = getattr(settings, "WALLETINSIGHTS_OUTFLOW_ALERT_THRESHOLD", 3.0)
+
+# Outflows seen for a division and ref type before its outflows can raise alerts.
+WALLETINSIGHTS_OUTFLOW_ALERT_MIN_SAMPLES = getattr(settings, "WALLETINSIGHTS_OUTFLOW_ALERT_MIN_SAMPLES", 20)
+
+# Outflows smaller than this many ISK never raise an alert.
+WALLETINSIGHTS_OUTFLOW_ALERT_MIN_AMOUNT = getattr(settings, "WALLETINSIGHTS_OUTFLOW_ALERT_MIN_AMOUNT", 100_000_000)
+
+# Celery queue and priority of the fast lane, which runs owner dispatch, division and balance syncs and alerts.
+# None keeps the default queue. Priorities follow Alliance Auth, 1 runs first and 9 last.
+WALLETINSIGHTS_FAST_QUEUE = getattr(settings, "WALLETINSIGHTS_FAST_QUEUE", None)
+WALLETINSIGHTS_FAST_PRIORITY = getattr(settings, "WALLETINSIGHTS_FAST_PRIORITY", 3)
+
+# Celery queue, priority and per worker rate limit (e.g. "30/m") of the bulk lane, which runs journal syncs,
+# name resolution and maintenance tasks.
+WALLETINSIGHTS_BULK_QUEUE = getattr(settings, "WALLETINSIGHTS_BULK_QUEUE", None)
+WALLETINSIGHTS_BULK_PRIORITY = getattr(settings, "WALLETINSIGHTS_BULK_PRIORITY", 7)
+WALLETINSIGHTS_BULK_RATE_LIMIT = getattr(settings, "WALLETINSIGHTS_BULK_RATE_LIMIT", None)
+
+# Journal pages imported per backfill task. Owners and divisions whose journal was never synced import their
+# history in chunks of this many pages, with a pause after each chunk. None imports the history in a single sync.
+WALLETINSIGHTS_BACKFILL_CHUNK_PAGES = getattr(settings, "WALLETINSIGHTS_BACKFILL_CHUNK_PAGES", 5)
+
+# Minimum seconds a backfill pauses between chunks. It pauses at least as long as the last chunk took,
+# so it slows down further while ESI or the database are slow.
+WALLETINSIGHTS_BACKFILL_CHUNK_DELAY = getattr(settings, "WALLETINSIGHTS_BACKFILL_CHUNK_DELAY", 30)
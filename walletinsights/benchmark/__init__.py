@@ -0,0 +1,4 @@
+"""
+Benchmark harness for the sync and dashboard hot paths.
+Run with the walletinsights_benchmark management command.
+"""
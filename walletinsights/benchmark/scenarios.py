@@ -0,0 +1,154 @@
+import time
+import tracemalloc
+from contextlib import ExitStack
+from unittest import mock
+
+from allianceauth.eveonline.models import EveCharacter
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory
+
+from .. import tasks, views
+from ..fetch import etag_cache_key
+from ..models import WalletDivision, WalletJournalEntry
+from .stub_esi import StubEsi, StubToken
+from .synthetic import CORPORATION_ID_BASE, ENTRY_ID_BASE, create_owners, delete_owners, journal_rows, populate_history
+
+BENCHMARK_USERNAME = "walletinsights_benchmark"
+
+
+def measure(name, func):
+    """
+    Run func once, recording wall time, database queries on this connection and peak Python memory.
+    """
+    queries = 0
+
+    def count_queries(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    tracemalloc.start()
+    # Count through an execute wrapper rather than the connection's query log, which keeps only the last 9000.
+    with connection.execute_wrapper(count_queries):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"scenario": name, "seconds": elapsed, "queries": queries, "peak_kib": peak / 1024}
+
+
+class Benchmark:
+    """
+    Builds a synthetic data set and runs the hot paths against it with the ESI stand-in swapped in.
+    :param owners: number of synthetic owners.
+    :param history: journal entries of history spread across all divisions.
+    :param sync_entries: journal entries served by the ESI stand-in per division.
+    :param new_entries: entries added on top of the served journal for the incremental sync.
+    :param latency: seconds of latency per ESI request.
+    :param page_size: journal entries per ESI page.
+    """
+    scenarios = ("journal_full", "journal_incremental", "journal_unchanged", "balances", "dashboard")
+
+    def __init__(self, owners=1, history=0, sync_entries=10_000, new_entries=50, latency=0.0, page_size=2500):
+        self.owner_count = owners
+        self.history = history
+        self.sync_entries = sync_entries
+        self.new_entries = new_entries
+        self.esi = StubEsi(latency=latency, page_size=page_size)
+        self.owners = []
+
+    @property
+    def corporation_id(self):
+        return self.owners[0].corp.corporation_id
+
+    def setup(self):
+        delete_owners()
+        self.owners = create_owners(self.owner_count)
+        if self.history:
+            populate_history(self.owners, self.history, balance_records=24 * 30)
+        for division_id in range(1, 8):
+            self.esi.set_journal(self.corporation_id, division_id, list(journal_rows(
+                self.sync_entries, start_entry_id=ENTRY_ID_BASE + division_id * self.sync_entries, seed=division_id
+            )))
+
+    def teardown(self):
+        delete_owners()
+        User.objects.filter(username=BENCHMARK_USERNAME).delete()
+        EveCharacter.objects.filter(character_id=CORPORATION_ID_BASE).delete()
+
+    def _clear_etags(self):
+        keys = [etag_cache_key("divisions", self.corporation_id), etag_cache_key("wallets", self.corporation_id)]
+        keys += [etag_cache_key("journal", self.corporation_id, division_id) for division_id in range(1, 8)]
+        cache.delete_many(keys)
+
+    def run(self, names=None):
+        """
+        Run the named scenarios, or all of them, in order.
+        :return: list of result dicts.
+        """
+        results = []
+        with ExitStack() as stack:
+            stack.enter_context(mock.patch("walletinsights.fetch.esi", self.esi))
+            stack.enter_context(mock.patch.object(tasks, "_get_token", lambda owner, token_id=None: StubToken()))
+            stack.enter_context(mock.patch.object(tasks.update_ownerchar_last_used, "delay"))
+            stack.enter_context(mock.patch.object(tasks.resolve_names, "delay"))
+            stack.enter_context(mock.patch.object(tasks.send_outflow_alerts, "delay"))
+            # The scenarios time the regular journal sync, synthetic divisions would otherwise be backfilled.
+            stack.enter_context(mock.patch.object(tasks, "WALLETINSIGHTS_BACKFILL_CHUNK_PAGES", None))
+            for name in names or self.scenarios:
+                # The unchanged journal scenario relies on the ETags the previous syncs stored.
+                if name != "journal_unchanged":
+                    self._clear_etags()
+                calls = self.esi.calls
+                not_modified = self.esi.not_modified
+                result = measure(name, getattr(self, f"_{name}"))
+                result["esi_requests"] = self.esi.calls - calls
+                result["not_modified"] = self.esi.not_modified - not_modified
+                results.append(result)
+        return results
+
+    def _journal_full(self):
+        divisions = WalletDivision.objects.filter(corp=self.owners[0])
+        WalletJournalEntry.objects.filter(division__in=divisions, entry_id__gte=ENTRY_ID_BASE).delete()
+        divisions.update(journal_last_entry_id=None, journal_last_entry_date=None)
+        tasks.update_owner_journals(self.corporation_id)
+
+    def _journal_incremental(self):
+        for division_id in range(1, 8):
+            rows = self.esi.journals[(self.corporation_id, division_id)]
+            newest = rows[0]["id"] if rows else ENTRY_ID_BASE + division_id * self.sync_entries
+            self.esi.set_journal(
+                self.corporation_id,
+                division_id,
+                list(journal_rows(self.new_entries, start_entry_id=newest + 1, days=1, seed=-division_id)) + rows
+            )
+        tasks.update_owner_journals(self.corporation_id)
+
+    def _journal_unchanged(self):
+        tasks.update_owner_journals(self.corporation_id)
+
+    def _balances(self):
+        tasks.update_division_balances(self.corporation_id)
+
+    def _dashboard(self):
+        character, _ = EveCharacter.objects.get_or_create(
+            character_id=CORPORATION_ID_BASE,
+            defaults={
+                "character_name": "Benchmark Character",
+                "corporation_id": self.corporation_id,
+                "corporation_name": self.owners[0].corp.corporation_name,
+                "corporation_ticker": self.owners[0].corp.corporation_ticker,
+            }
+        )
+        user, _ = User.objects.get_or_create(username=BENCHMARK_USERNAME, defaults={"is_superuser": True})
+        user.profile.main_character = character
+        user.profile.save()
+        for owner in self.owners:
+            owner.invalidate_dashboard_card()
+
+        request = RequestFactory().get("/walletinsights/")
+        request.user = user
+        views.dashboard(request)
@@ -0,0 +1,114 @@
+import time
+import zlib
+from email.utils import format_datetime
+from types import SimpleNamespace
+
+from bravado.exception import HTTPNotModified
+from django.utils.timezone import now
+
+
+class StubResponse:
+    def __init__(self, headers, status_code=200, reason="OK"):
+        self.headers = headers
+        self.status_code = status_code
+        self.reason = reason
+        self.text = ""
+
+
+class StubOperation:
+    """
+    Stands in for a bravado operation future.
+    Like ESI, it answers 304 Not Modified when If-None-Match carries the ETag of the data it would return.
+    """
+    def __init__(self, esi, data, etag, pages=1, request_options=None):
+        self.esi = esi
+        self.data = data
+        self.etag = f'"{etag}"'
+        self.pages = pages
+        self.request_headers = (request_options or {}).get("headers", {})
+        self.request_config = SimpleNamespace(also_return_response=False)
+
+    def result(self):
+        time.sleep(self.esi.latency)
+        self.esi.calls += 1
+        headers = {
+            "X-Pages": str(self.pages),
+            "ETag": self.etag,
+            # Already expired, so every request is sent and the ETag decides whether data comes back.
+            "Expires": format_datetime(now()),
+            "X-Esi-Error-Limit-Remain": "100",
+            "X-Esi-Error-Limit-Reset": "60",
+        }
+        if self.request_headers.get("If-None-Match") == self.etag:
+            self.esi.not_modified += 1
+            raise HTTPNotModified(StubResponse(headers, status_code=304, reason="Not Modified"))
+        if self.request_config.also_return_response:
+            return self.data, StubResponse(headers)
+        return self.data
+
+
+def _content_etag(data):
+    return f"stub-{zlib.crc32(repr(data).encode()):08x}"
+
+
+class StubEsi:
+    """
+    In-process stand-in for the ESI wallet, divisions and journal endpoints, with pagination
+    and a fixed latency per request. Swap it in for providers.esi to benchmark without ESI.
+    """
+    def __init__(self, latency=0.0, page_size=2500):
+        self.latency = latency
+        self.page_size = page_size
+        self.calls = 0
+        self.not_modified = 0
+        self.journals = {}
+        self.journal_versions = {}
+        self.balances = {}
+        self.client = SimpleNamespace(
+            Corporation=SimpleNamespace(get_corporations_corporation_id_divisions=self._divisions),
+            Wallet=SimpleNamespace(
+                get_corporations_corporation_id_wallets=self._wallets,
+                get_corporations_corporation_id_wallets_division_journal=self._journal,
+            ),
+        )
+
+    def set_journal(self, corporation_id, division_id, rows):
+        """
+        Serve rows, newest first, as the journal of a division.
+        """
+        key = (corporation_id, division_id)
+        self.journals[key] = rows
+        # Each journal version gets its own ETags, hashing the rows on every request would skew the timings.
+        self.journal_versions[key] = self.journal_versions.get(key, 0) + 1
+
+    def _divisions(self, corporation_id, _request_options=None, **kwargs):
+        data = {
+            "wallet": [{"division": i, "name": None if i == 1 else f"Division {i}"} for i in range(1, 8)],
+            "hangar": [],
+        }
+        return StubOperation(self, data, _content_etag(data), request_options=_request_options)
+
+    def _wallets(self, corporation_id, _request_options=None, **kwargs):
+        balances = self.balances.get(corporation_id, [1_000_000_000.0] * 7)
+        data = [{"division": i + 1, "balance": balance} for i, balance in enumerate(balances)]
+        return StubOperation(self, data, _content_etag(data), request_options=_request_options)
+
+    def _journal(self, corporation_id, division, page=1, _request_options=None, **kwargs):
+        rows = self.journals.get((corporation_id, division), [])
+        pages = max(1, -(-len(rows) // self.page_size))
+        start = (page - 1) * self.page_size
+        etag = f"stub-{corporation_id}-{division}-{self.journal_versions.get((corporation_id, division), 0)}-{page}"
+        return StubOperation(
+            self, [dict(row) for row in rows[start:start + self.page_size]], etag, pages, _request_options
+        )
+
+
+class StubToken:
+    """
+    Stands in for an esi Token, so no SSO refresh is attempted.
+    """
+    pk = 0
+    character_id = 0
+
+    def valid_access_token(self):
+        return "stub-access-token"
@@ -0,0 +1,131 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+from itertools import islice
+
+from allianceauth.eveonline.models import EveCorporationInfo
+from django.utils.timezone import now
+
+from ..models import Owner, WalletBalanceRecord, WalletDivision, WalletJournalEntry
+
+# Synthetic corporations get ids from this range, well clear of real EVE corporation ids.
+CORPORATION_ID_BASE = 2_000_000_000
+# Journal ids served by the ESI stand-in start at ENTRY_ID_BASE. Stored history gets lower ids, as it is older,
+# so it never moves the high-water mark past the served journal.
+ENTRY_ID_BASE = 30_000_000_000
+HISTORY_ENTRY_ID_BASE = 10_000_000_000
+
+REF_TYPES = (
+    "bounty_prizes",
+    "ess_escrow_transfer",
+    "brokers_fee",
+    "transaction_tax",
+    "market_transaction",
+    "corporation_account_withdrawal",
+    "player_donation",
+    "industry_job_tax",
+    "planetary_export_tax",
+    "office_rental_fee",
+)
+
+
+def journal_rows(count, start_entry_id=ENTRY_ID_BASE, days=30, seed=0):
+    """
+    Yield ESI shaped journal rows, newest first, spread evenly over the last days.
+    :param count: number of rows.
+    :param start_entry_id: id of the oldest row.
+    :param days: period the rows are spread over.
+    :param seed: random seed, the same seed always gives the same rows.
+    """
+    rng = random.Random(seed)
+    newest = now()
+    step = timedelta(days=days) / max(count, 1)
+    balance = Decimal("1000000000.00")
+    for i in range(count):
+        amount = Decimal(rng.randint(-50_000_000, 100_000_000)) / 100
+        ref_type = REF_TYPES[rng.randrange(len(REF_TYPES))]
+        balance -= amount
+        yield {
+            "id": start_entry_id + count - 1 - i,
+            "amount": amount,
+            "balance": balance,
+            "context_id": rng.randint(1, 2**40),
+            "context_id_type": "market_transaction_id",
+            "date": newest - step * i,
+            "description": f"Synthetic {ref_type}",
+            "first_party_id": rng.randint(90_000_000, 99_000_000),
+            "reason": None,
+            "ref_type": ref_type,
+            "second_party_id": rng.randint(90_000_000, 99_000_000),
+            "tax": abs(amount) / 10 if ref_type == "bounty_prizes" else None,
+            "tax_receiver_id": None,
+        }
+
+
+def create_owners(count):
+    """
+    Create synthetic owners, each with all seven wallet divisions.
+    :return: list of Owners
+    """
+    owners = []
+    for i in range(count):
+        corporation_id = CORPORATION_ID_BASE + i
+        corp, _ = EveCorporationInfo.objects.get_or_create(
+            corporation_id=corporation_id,
+            defaults={
+                "corporation_name": f"Benchmark Corp {i}",
+                "corporation_ticker": f"BM{i}"[:5],
+                "member_count": 1,
+            }
+        )
+        owner, _ = Owner.objects.get_or_create(corp=corp)
+        for division_id in range(1, 8):
+            WalletDivision.objects.get_or_create(
+                corp=owner,
+                division_id=division_id,
+                defaults={"division_name": f"Division {division_id}"}
+            )
+        owners.append(owner)
+    return owners
+
+
+def populate_history(owners, entries, balance_records=0, batch_size=5000):
+    """
+    Fill the journal of the owners' divisions with synthetic history spread over the past year,
+    in batches so any scale fits in memory.
+    :param owners:
+    :param entries: total number of journal entries to create across all divisions.
+    :param balance_records: balance records to create per division.
+    :param batch_size:
+    """
+    divisions = list(WalletDivision.objects.filter(corp__in=owners))
+    per_division = entries // len(divisions)
+    for n, division in enumerate(divisions):
+        rows = journal_rows(per_division, start_entry_id=HISTORY_ENTRY_ID_BASE + n * per_division, days=365, seed=n)
+        # Keep the history older than anything the ESI stand-in serves.
+        shift = timedelta(days=31)
+        while batch := list(islice(rows, batch_size)):
+            for row in batch:
+                row["date"] -= shift
+            WalletJournalEntry.objects.bulk_create(
+                WalletJournalEntry.objects.from_esi(division, batch),
+                batch_size=batch_size,
+                ignore_conflicts=True
+            )
+
+        records = [
+            WalletBalanceRecord(division=division, balance=Decimal(1_000_000 * (i + 1)))
+            for i in range(balance_records)
+        ]
+        WalletBalanceRecord.objects.bulk_create(records, batch_size=batch_size)
+
+
+def delete_owners():
+    """
+    Remove every synthetic owner and its data.
+    """
+    corps = EveCorporationInfo.objects.filter(
+        corporation_id__gte=CORPORATION_ID_BASE, corporation_id__lt=CORPORATION_ID_BASE + 1_000_000
+    )
+    Owner.objects.filter(corp__in=corps).delete()
+    corps.delete()
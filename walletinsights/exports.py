@@ -0,0 +1,136 @@
+import csv
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from django.db.models import Q
+from django.utils.timezone import make_aware
+
+from .app_settings import WALLETINSIGHTS_EXPORT_CHUNK_SIZE
+from .models import RefType, WalletJournalEntry, WalletJournalEntryArchive
+
+EXPORT_COLUMNS = (
+    ("entry_id", "entry_id"),
+    ("corporation_id", "division__corp__corp__corporation_id"),
+    ("division", "division__division_id"),
+    ("date", "date"),
+    ("ref_type", "ref_type__name"),
+    ("amount", "amount"),
+    ("balance", "balance"),
+    ("tax", "tax"),
+    ("tax_receiver_id", "tax_receiver_id"),
+    ("first_party_id", "first_party_id"),
+    ("second_party_id", "second_party_id"),
+    ("context_id", "context_id"),
+    ("context_id_type", "context_id_type__name"),
+    ("description", "description"),
+    ("reason", "reason"),
+)
+
+
+def journal_export_queryset(
+    corporation_id=None, division_id=None, start=None, end=None, ref_types=None, party_id=None,
+    min_amount=None, max_amount=None, archived=False
+):
+    """
+    Journal entries matching the export filters.
+    :param corporation_id: owner corporation.
+    :param division_id: wallet division number (1-7).
+    :param start: first day to include.
+    :param end: last day to include.
+    :param ref_types: list of ref types to include.
+    :param party_id: only entries where this id is the first or second party.
+    :param min_amount: smallest amount to include.
+    :param max_amount: largest amount to include.
+    :param archived: export entries from the archive rather than the main journal.
+    :return:
+    """
+    qs = (WalletJournalEntryArchive if archived else WalletJournalEntry).objects.all()
+    if corporation_id is not None:
+        qs = qs.filter(division__corp__corp__corporation_id=corporation_id)
+    if division_id is not None:
+        qs = qs.filter(division__division_id=division_id)
+    if start is not None:
+        qs = qs.filter(date__gte=make_aware(datetime.combine(start, time.min)))
+    if end is not None:
+        qs = qs.filter(date__lt=make_aware(datetime.combine(end + timedelta(days=1), time.min)))
+    if ref_types:
+        qs = qs.filter(ref_type_id__in=RefType.objects.ids_of(ref_types))
+    if party_id is not None:
+        qs = qs.filter(Q(first_party_id=party_id) | Q(second_party_id=party_id))
+    if min_amount is not None:
+        qs = qs.filter(amount__gte=min_amount)
+    if max_amount is not None:
+        qs = qs.filter(amount__lte=max_amount)
+    return qs
+
+
+def iter_export_rows(queryset, chunk_size=WALLETINSIGHTS_EXPORT_CHUNK_SIZE):
+    """
+    Yield export rows as tuples in primary key order, one chunk per query.
+    Chunks are paged on the primary key rather than relying on server-side cursors,
+    which MySQL does not support, so memory use stays constant on every backend.
+    """
+    fields = ["pk", *[field for _, field in EXPORT_COLUMNS]]
+    last_pk = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_pk).order_by("pk").values_list(*fields)[:chunk_size])
+        if not chunk:
+            return
+        for row in chunk:
+            yield row[1:]
+        last_pk = chunk[-1][0]
+
+
+class _Echo:
+    """
+    File-like object that hands back what is written to it, for streaming csv output.
+    """
+    def write(self, value):
+        return value
+
+
+def iter_csv_lines(queryset, chunk_size=WALLETINSIGHTS_EXPORT_CHUNK_SIZE):
+    """
+    Yield the export as csv lines, starting with the header.
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow([name for name, _ in EXPORT_COLUMNS])
+    for row in iter_export_rows(queryset, chunk_size):
+        yield writer.writerow(row)
+
+
+def write_parquet(queryset, path, chunk_size=WALLETINSIGHTS_EXPORT_CHUNK_SIZE):
+    """
+    Write the export to a parquet file, one row group per chunk.
+    Requires pyarrow, install with walletinsights[parquet].
+    :return: number of rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    money = pa.decimal128(20, 2)
+    schema = pa.schema([
+        ("entry_id", pa.int64()),
+        ("corporation_id", pa.int32()),
+        ("division", pa.int8()),
+        ("date", pa.timestamp("us", tz="UTC")),
+        ("ref_type", pa.string()),
+        ("amount", money),
+        ("balance", money),
+        ("tax", money),
+        ("tax_receiver_id", pa.int32()),
+        ("first_party_id", pa.int32()),
+        ("second_party_id", pa.int32()),
+        ("context_id", pa.int64()),
+        ("context_id_type", pa.string()),
+        ("description", pa.string()),
+        ("reason", pa.string()),
+    ])
+
+    written = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        rows = iter_export_rows(queryset, chunk_size)
+        while chunk := list(islice(rows, chunk_size)):
+            writer.write_table(pa.Table.from_pylist([dict(zip(schema.names, row)) for row in chunk], schema=schema))
+            written += len(chunk)
+    return written
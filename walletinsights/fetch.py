@@ -0,0 +1,472 @@
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import copy_context
+from email.utils import parsedate_to_datetime
+
+from allianceauth.services.hooks import get_extension_logger
+from bravado.exception import (
+    BravadoConnectionError, BravadoTimeoutError, HTTPError, HTTPForbidden, HTTPNotFound, HTTPNotModified,
+    HTTPServerError, HTTPUnauthorized
+)
+from django.core.cache import cache
+from django.db import connections
+from django.utils.timezone import now
+from esi.errors import TokenError
+
+from .app_settings import (
+    WALLETINSIGHTS_ESI_ERROR_LIMIT_THRESHOLD,
+    WALLETINSIGHTS_ESI_ETAG_TTL,
+    WALLETINSIGHTS_ESI_JOURNAL_WORKERS,
+    WALLETINSIGHTS_ESI_MAX_CONCURRENT_REQUESTS,
+    WALLETINSIGHTS_ESI_MAX_CONCURRENT_REQUESTS_PER_TOKEN,
+)
+from .metrics import counting_queries, record, timed
+from .providers import esi
+
+logger = get_extension_logger(__name__)
+
+ETAG_CACHE_PREFIX = "walletinsights:esi"
+ERROR_LIMIT_CACHE_KEY = "walletinsights:esi_error_limited_until"
+IN_FLIGHT_CACHE_PREFIX = "walletinsights:esi_in_flight"
+# Safety net so a worker that dies mid-request can not hold a request slot forever.
+IN_FLIGHT_TTL = 120
+# Seconds a request waits for a free request slot, checking every SLOT_POLL_INTERVAL seconds.
+SLOT_WAIT = 5
+SLOT_POLL_INTERVAL = 0.1
+# Maximum number of ids /universe/names/ accepts per request.
+NAMES_BATCH_SIZE = 1000
+JOURNAL_CHECKPOINT_CACHE_PREFIX = "walletinsights:journal_checkpoint"
+JOURNAL_CHECKPOINT_TTL = 60 * 60 * 24
+
+# Errors worth retrying the same request for later.
+TRANSIENT_ERRORS = (HTTPServerError, BravadoConnectionError, BravadoTimeoutError)
+# Errors caused by the token, which another character's token may not have.
+TOKEN_ERRORS = (HTTPForbidden, HTTPUnauthorized, TokenError)
+
+
+class NotModified(Exception):
+    """
+    Raised when ESI has nothing newer than the last response we processed.
+    """
+
+
+class EsiRateLimited(Exception):
+    """
+    Raised instead of sending a request while the ESI error limit is low or too many requests are in flight.
+    """
+    def __init__(self, retry_after):
+        super().__init__(f"ESI requests paused, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _record_error_limit(headers):
+    try:
+        remain = int(headers["X-Esi-Error-Limit-Remain"])
+        reset = int(headers["X-Esi-Error-Limit-Reset"])
+    except (KeyError, TypeError, ValueError):
+        return
+    if remain <= WALLETINSIGHTS_ESI_ERROR_LIMIT_THRESHOLD:
+        logger.warning(f"ESI error limit down to {remain}, pausing requests for {reset}s.")
+        cache.set(ERROR_LIMIT_CACHE_KEY, now().timestamp() + reset, timeout=reset or 1)
+
+
+def _check_error_limit():
+    limited_until = cache.get(ERROR_LIMIT_CACHE_KEY)
+    if limited_until:
+        raise EsiRateLimited(retry_after=max(int(limited_until - now().timestamp()) + 1, 1))
+
+
+def _release_slot(key):
+    try:
+        cache.decr(key)
+    except ValueError:
+        # Slot counter expired while the request was running.
+        pass
+
+
+@contextmanager
+def _request_slot(token_id, wait=SLOT_WAIT):
+    """
+    Hold one of the global and per-token ESI request slots for the duration of the block.
+    Unauthenticated requests, with token_id None, only take a global slot.
+    Requests running alongside each other under the same token usually finish quickly,
+    so a full slot is waited for up to wait seconds before giving up.
+    :param token_id:
+    :param wait: seconds to wait for a free slot, default: SLOT_WAIT
+    :raises EsiRateLimited: if no slot freed up in time.
+    """
+    limits = {IN_FLIGHT_CACHE_PREFIX: WALLETINSIGHTS_ESI_MAX_CONCURRENT_REQUESTS}
+    if token_id is not None:
+        limits[f"{IN_FLIGHT_CACHE_PREFIX}:{token_id}"] = WALLETINSIGHTS_ESI_MAX_CONCURRENT_REQUESTS_PER_TOKEN
+    deadline = time.monotonic() + wait
+    held = []
+    try:
+        for key, limit in limits.items():
+            while True:
+                cache.add(key, 0, timeout=IN_FLIGHT_TTL)
+                if cache.incr(key) <= limit:
+                    held.append(key)
+                    break
+                _release_slot(key)
+                if time.monotonic() >= deadline:
+                    raise EsiRateLimited(retry_after=1)
+                # Jittered, so waiting requests do not all retry at the same moment.
+                time.sleep(SLOT_POLL_INTERVAL * random.uniform(0.5, 1.5))
+        yield
+    finally:
+        for key in held:
+            _release_slot(key)
+
+
+def _access_token(token):
+    with timed("token_seconds"):
+        return token.valid_access_token()
+
+
+def _perform(request, token=None):
+    """
+    Send a prepared ESI request, honouring the global error limit and the in-flight request caps.
+    :param request:
+    :param token: Token the request is authenticated with, None for public endpoints.
+    :return: tuple of (data, response headers)
+    """
+    _check_error_limit()
+    request.request_config.also_return_response = True
+    with _request_slot(token.pk if token else None), timed("esi_seconds", "esi_requests"):
+        try:
+            data, response = request.result()
+        except HTTPError as e:
+            if not isinstance(e, HTTPNotModified):
+                record(esi_errors=1)
+            if e.response is not None:
+                _record_error_limit(e.response.headers)
+            raise
+    _record_error_limit(response.headers)
+    return data, response.headers
+
+
+def etag_cache_key(endpoint, *args):
+    return ":".join([ETAG_CACHE_PREFIX, endpoint, *[str(arg) for arg in args]])
+
+
+def _expires(headers):
+    try:
+        return parsedate_to_datetime(headers["Expires"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def store_etag(cache_key, headers, etag=None):
+    """
+    Remember the ETag and expiry of a processed response, so the next request for cache_key is conditional.
+    Call this only once the response was stored, so a response whose storing failed is fetched again.
+    :param cache_key:
+    :param headers: response headers.
+    :param etag: ETag to keep if the headers have none, default: None
+    :return:
+    """
+    etag = headers.get("ETag", etag)
+    if etag is None:
+        return
+    cache.set(
+        cache_key,
+        {"etag": etag, "expires": _expires(headers)},
+        timeout=WALLETINSIGHTS_ESI_ETAG_TTL
+    )
+
+
+def next_fetch_at(cache_key):
+    """
+    Timestamp at which the response stored under cache_key expires, or None if it is unknown.
+    """
+    cached = cache.get(cache_key)
+    return cached["expires"] if cached else None
+
+
+def esi_request(operation, cache_key, token, **params):
+    """
+    Run an ESI operation as a conditional request.
+    The ETag of the last processed response is sent as If-None-Match, and requests made
+    before the last response expired are not sent at all. The caller saves the ETag of
+    a new response with store_etag once it has stored the data.
+    :param operation: bravado operation, e.g. esi.client.Wallet.get_corporations_corporation_id_wallets
+    :param cache_key: key the ETag for these parameters is stored under.
+    :param token: Token used to authenticate the request.
+    :param params: operation parameters.
+    :return: tuple of (data, response headers)
+    :raises NotModified: if the data has not changed since the last response.
+    :raises EsiRateLimited: if requests are currently paused.
+    """
+    cached = cache.get(cache_key)
+    request_options = {}
+    if cached:
+        if cached["expires"] is not None and cached["expires"] > now().timestamp():
+            record(cache_hits=1)
+            raise NotModified(cache_key)
+        request_options["headers"] = {"If-None-Match": cached["etag"]}
+
+    request = operation(token=_access_token(token), _request_options=request_options, **params)
+    try:
+        data, headers = _perform(request, token)
+    except HTTPNotModified as e:
+        store_etag(cache_key, e.response.headers, etag=cached["etag"])
+        record(cache_hits=1)
+        raise NotModified(cache_key) from e
+    return data, headers
+
+
+def fetch_divisions(corporation_id, token):
+    """
+    Fetch the division names of a corporation.
+    :return: tuple of (data, response headers)
+    :raises NotModified:
+    """
+    return esi_request(
+        esi.client.Corporation.get_corporations_corporation_id_divisions,
+        etag_cache_key("divisions", corporation_id),
+        token,
+        corporation_id=corporation_id
+    )
+
+
+def fetch_balances(corporation_id, token):
+    """
+    Fetch the wallet balances of a corporation.
+    :return: tuple of (data, response headers)
+    :raises NotModified:
+    """
+    return esi_request(
+        esi.client.Wallet.get_corporations_corporation_id_wallets,
+        etag_cache_key("wallets", corporation_id),
+        token,
+        corporation_id=corporation_id
+    )
+
+
+def fetch_journal_page(corporation_id, division_id, token, page=1, conditional=True):
+    """
+    Fetch a single page of a division's journal.
+    Only the first page is requested conditionally, as every new entry shifts the later pages.
+    :param corporation_id:
+    :param division_id:
+    :param token:
+    :param page:
+    :param conditional: request the first page conditionally, default: True
+    :return: tuple of (entries, total number of pages, response headers)
+    :raises NotModified: if the first page has not changed.
+    """
+    operation = esi.client.Wallet.get_corporations_corporation_id_wallets_division_journal
+    params = {"corporation_id": corporation_id, "division": division_id, "page": page}
+    if page == 1 and conditional:
+        entries, headers = esi_request(operation, etag_cache_key("journal", corporation_id, division_id), token, **params)
+    else:
+        entries, headers = _perform(operation(token=_access_token(token), **params), token)
+    record(pages=1)
+    return entries, int(headers.get("X-Pages", 1)), headers
+
+
+def _store_journal_etag(corporation_id, division_id, headers):
+    # Pagers call this once every page was handed over and stored, so a sync that fails part way
+    # requests the first page again instead of being told it is not modified.
+    if headers is not None:
+        store_etag(etag_cache_key("journal", corporation_id, division_id), headers)
+
+
+def fetch_names(ids):
+    """
+    Resolve ids to names with a single /universe/names/ request.
+    ESI rejects the whole request if any id is unknown, so a rejected batch is split
+    until the unknown ids are isolated.
+    :param ids: list of at most NAMES_BATCH_SIZE ids.
+    :return: tuple of (list of dicts with id, name and category, list of ids ESI does not know)
+    :raises EsiRateLimited:
+    """
+    try:
+        data, _ = _perform(esi.client.Universe.post_universe_names(ids=ids))
+    except HTTPNotFound:
+        if len(ids) == 1:
+            return [], ids
+        middle = len(ids) // 2
+        names, unknown = fetch_names(ids[:middle])
+        more_names, more_unknown = fetch_names(ids[middle:])
+        return names + more_names, unknown + more_unknown
+    return data, []
+
+
+def _journal_checkpoint_key(division):
+    return f"{JOURNAL_CHECKPOINT_CACHE_PREFIX}:{division.pk}"
+
+
+def journal_checkpoint(division):
+    """
+    Last journal page stored by an interrupted sync of the division, or 0 if there is none.
+    New entries only push older entries onto later pages, so the entries that were not stored
+    yet are always found after this page.
+    """
+    checkpoint = cache.get(_journal_checkpoint_key(division))
+    if checkpoint is None or checkpoint["last_entry_id"] != division.journal_last_entry_id:
+        return 0
+    return checkpoint["page"]
+
+
+def save_journal_checkpoint(division, page):
+    cache.set(
+        _journal_checkpoint_key(division),
+        {"last_entry_id": division.journal_last_entry_id, "page": page},
+        timeout=JOURNAL_CHECKPOINT_TTL
+    )
+
+
+def clear_journal_checkpoint(division):
+    cache.delete(_journal_checkpoint_key(division))
+
+
+def iter_journal_pages(corporation_id, division, token):
+    """
+    Yield a division's journal pages, as (page number, entries newer than its high-water mark).
+    ESI returns the journal newest first, so paging stops at the first page that holds
+    nothing newer than the mark. A sync that was interrupted resumes after its checkpoint.
+    The ETag of the first page is saved once the last page was handed over and stored.
+    :param corporation_id:
+    :param division: WalletDivision to fetch.
+    :param token:
+    :return:
+    :raises NotModified: if the journal has not changed since the last sync.
+    """
+    last_entry_id = division.journal_last_entry_id
+    page = journal_checkpoint(division) + 1
+    pages = page
+    first_page_headers = None
+    while page <= pages:
+        try:
+            entries, pages, headers = fetch_journal_page(corporation_id, division.division_id, token, page)
+        except HTTPNotFound:
+            # Resumed past the end of a journal that shrank in the meantime.
+            if page > 1:
+                break
+            raise
+        if page == 1:
+            first_page_headers = headers
+        if last_entry_id is not None:
+            entries = [entry for entry in entries if entry["id"] > last_entry_id]
+            if not entries:
+                logger.debug(f"Journal for {corporation_id} division {division.division_id} caught up at page {page}.")
+                break
+        yield page, entries
+        page += 1
+    _store_journal_etag(corporation_id, division.division_id, first_page_headers)
+
+
+def iter_journal_page_range(corporation_id, division_id, token, first_page, count):
+    """
+    Yield up to count journal pages of a division from first_page on, as (page number, entries, total pages).
+    Pages are fetched one at a time and unconditionally, and nothing is filtered against the high-water mark,
+    so a journal can be imported a few pages at a time.
+    :param corporation_id:
+    :param division_id:
+    :param token:
+    :param first_page:
+    :param count: maximum number of pages.
+    :return:
+    """
+    page = first_page
+    pages = first_page
+    while page <= pages and page < first_page + count:
+        try:
+            entries, pages, _ = fetch_journal_page(corporation_id, division_id, token, page, conditional=False)
+        except HTTPNotFound:
+            # Resumed past the end of a journal that shrank in the meantime.
+            if page > 1:
+                return
+            raise
+        yield page, entries, pages
+        page += 1
+
+
+def _fetch_journal_page_in_thread(corporation_id, division_id, token, page):
+    try:
+        with counting_queries():
+            return fetch_journal_page(corporation_id, division_id, token, page)
+    finally:
+        # Refreshing the token may have opened a connection for this thread.
+        connections.close_all()
+
+
+def _iter_division_pages(executor, corporation_id, division, token, page, first_page, window):
+    last_entry_id = division.journal_last_entry_id
+    try:
+        entries, pages, first_page_headers = first_page.result()
+    except HTTPNotFound:
+        # Resumed past the end of a journal that shrank in the meantime.
+        if page > 1:
+            return
+        raise
+    if page > 1:
+        first_page_headers = None
+    pending = deque()
+    next_page = page + 1
+    try:
+        while True:
+            reached_mark = False
+            if last_entry_id is not None:
+                new_entries = [entry for entry in entries if entry["id"] > last_entry_id]
+                reached_mark = len(new_entries) < len(entries)
+                entries = new_entries
+                if not entries:
+                    logger.debug(
+                        f"Journal for {corporation_id} division {division.division_id} caught up at page {page}."
+                    )
+                    break
+            # Once a page reaches the high-water mark the pages after it are most likely old,
+            # so only the next page is fetched to confirm it instead of a full window.
+            limit = 1 if reached_mark else window
+            while next_page <= pages and len(pending) < limit:
+                pending.append(executor.submit(
+                    copy_context().run,
+                    _fetch_journal_page_in_thread, corporation_id, division.division_id, token, next_page
+                ))
+                next_page += 1
+            yield page, entries
+            if not pending:
+                break
+            entries, _, _ = pending.popleft().result()
+            page += 1
+    finally:
+        for future in pending:
+            future.cancel()
+    _store_journal_etag(corporation_id, division.division_id, first_page_headers)
+
+
+def iter_owner_journal_pages(corporation_id, divisions, token, workers=WALLETINSIGHTS_ESI_JOURNAL_WORKERS):
+    """
+    Yield (division, pages) for every division of an owner, where pages is an iterator over
+    the division's journal pages as (page number, entries newer than its high-water mark).
+    Pages of all divisions are fetched on a bounded thread pool under one token and handed over
+    in order as they arrive, so rows can be stored while later pages are still downloading.
+    Divisions whose last sync was interrupted resume after their checkpoint.
+    Iterating a division's pages raises NotModified if its journal has not changed. First pages
+    are fetched up front, but their ETags are only saved once the division's pages were stored,
+    so divisions that were never reached because the sync failed are fetched in full again.
+    :param corporation_id:
+    :param divisions: WalletDivisions to fetch.
+    :param token:
+    :param workers: number of concurrent requests.
+    :return:
+    """
+    # Refresh the token up front so the worker threads can use the cached access token.
+    _access_token(token)
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="walletinsights-journal")
+    try:
+        first_pages = []
+        for division in divisions:
+            page = journal_checkpoint(division) + 1
+            first_pages.append((division, page, executor.submit(
+                copy_context().run, _fetch_journal_page_in_thread, corporation_id, division.division_id, token, page
+            )))
+        for division, page, first_page in first_pages:
+            yield division, _iter_division_pages(executor, corporation_id, division, token, page, first_page, workers)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
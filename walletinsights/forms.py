@@ -0,0 +1,36 @@
+from django import forms
+from django.utils.translation import gettext_lazy as _
+
+
+class DateRangeForm(forms.Form):
+    start = forms.DateField(label=_("From"), required=False)
+    end = forms.DateField(label=_("To"), required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start, end = cleaned_data.get("start"), cleaned_data.get("end")
+        if start and end and start > end:
+            raise forms.ValidationError(_("The start date must be before the end date."))
+        return cleaned_data
+
+
+class JournalFilterForm(DateRangeForm):
+    corporation_id = forms.IntegerField(label=_("Corporation"))
+    division = forms.IntegerField(label=_("Division"), min_value=1, max_value=7, required=False)
+    ref_type = forms.CharField(
+        label=_("Ref types"),
+        required=False,
+        help_text=_("Comma separated list of ref types.")
+    )
+
+    party_id = forms.IntegerField(label=_("Party ID"), required=False)
+    min_amount = forms.DecimalField(label=_("Min amount"), max_digits=20, decimal_places=2, required=False)
+    max_amount = forms.DecimalField(label=_("Max amount"), max_digits=20, decimal_places=2, required=False)
+
+    def clean_ref_type(self):
+        return [ref_type.strip() for ref_type in self.cleaned_data["ref_type"].split(",") if ref_type.strip()]
+
+
+class JournalBrowseForm(JournalFilterForm):
+    after = forms.CharField(required=False, widget=forms.HiddenInput)
+    limit = forms.IntegerField(min_value=1, max_value=500, required=False)
@@ -0,0 +1,45 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from django.db.models import Q
+
+PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(entry):
+    """
+    Opaque cursor pointing just past entry in (date, entry_id) order.
+    """
+    return urlsafe_b64encode(f"{entry.date.isoformat()}|{entry.entry_id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        date, entry_id = urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(date), int(entry_id)
+    except ValueError as e:
+        raise InvalidCursor(cursor) from e
+
+
+def journal_page(queryset, after=None, limit=PAGE_SIZE):
+    """
+    One page of journal entries, newest first, using keyset pagination on (date, entry_id),
+    so every page costs the same as the first however deep it is.
+    :param queryset: filtered WalletJournalEntry queryset.
+    :param after: cursor returned with the previous page.
+    :param limit: entries per page.
+    :return: tuple of (list of entries, cursor of the next page or None)
+    :raises InvalidCursor:
+    """
+    queryset = queryset.order_by("-date", "-entry_id")
+    if after:
+        date, entry_id = decode_cursor(after)
+        queryset = queryset.filter(Q(date__lt=date) | Q(date=date, entry_id__lt=entry_id))
+    entries = list(queryset[:limit + 1])
+    if len(entries) > limit:
+        return entries[:limit], encode_cursor(entries[limit - 1])
+    return entries, None
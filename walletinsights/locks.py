@@ -0,0 +1,65 @@
+from contextlib import contextmanager
+from functools import wraps
+from uuid import uuid4
+
+from allianceauth.services.hooks import get_extension_logger
+from django.core.cache import cache
+
+from .app_settings import WALLETINSIGHTS_SYNC_LOCK_TIMEOUT
+
+logger = get_extension_logger(__name__)
+
+LOCK_CACHE_PREFIX = "walletinsights:sync_lock"
+QUEUED_CACHE_PREFIX = "walletinsights:sync_queued"
+
+
+@contextmanager
+def owner_lock(name, owner_corp_id, timeout=WALLETINSIGHTS_SYNC_LOCK_TIMEOUT):
+    """
+    Try to take the named sync lock of an owner for the duration of the block.
+    The lock expires after timeout seconds, so a killed worker cannot hold it forever.
+    :param name: what is being synced, e.g. journal.
+    :param owner_corp_id:
+    :param timeout: default: WALLETINSIGHTS_SYNC_LOCK_TIMEOUT
+    :return: True if the lock was taken, False if another run holds it.
+    """
+    key = f"{LOCK_CACHE_PREFIX}:{name}:{owner_corp_id}"
+    holder = uuid4().hex
+    acquired = cache.add(key, holder, timeout=timeout)
+    try:
+        yield acquired
+    finally:
+        # Do not release a lock that expired and was taken by another run in the meantime.
+        if acquired and cache.get(key) == holder:
+            cache.delete(key)
+
+
+def owner_locked(name):
+    """
+    Run a bound sync task only if no other run holds the named lock of its owner, skipping it otherwise.
+    The task must take the owner corporation id as its first argument.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(task, owner_corp_id, *args, **kwargs):
+            with owner_lock(name, owner_corp_id) as acquired:
+                if not acquired:
+                    logger.info(f"{name} sync for {owner_corp_id} already running. Skipping.")
+                    return None
+                return func(task, owner_corp_id, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def mark_queued(owner_corp_id, timeout):
+    """
+    Mark an owner update as queued.
+    :param owner_corp_id:
+    :param timeout: seconds after which the mark expires, in case the queued task is lost.
+    :return: False if an update for the owner is already queued.
+    """
+    return cache.add(f"{QUEUED_CACHE_PREFIX}:{owner_corp_id}", True, timeout=timeout)
+
+
+def clear_queued(owner_corp_id):
+    cache.delete(f"{QUEUED_CACHE_PREFIX}:{owner_corp_id}")
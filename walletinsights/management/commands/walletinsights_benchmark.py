@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+
+from ...benchmark.scenarios import Benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the journal sync, balance sync and dashboard against synthetic data and a local ESI stand-in. "
+        "Creates and removes its own owners, do not run it against a busy production database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scenario",
+            action="append",
+            dest="scenarios",
+            choices=Benchmark.scenarios,
+            help="Scenario to run. Can be given more than once, runs all scenarios by default."
+        )
+        parser.add_argument("--owners", type=int, default=1, help="Number of synthetic owners.")
+        parser.add_argument(
+            "--history",
+            type=int,
+            default=0,
+            help="Journal entries of history to generate across all divisions, e.g. 1000 to 10000000."
+        )
+        parser.add_argument("--sync-entries", type=int, default=10_000, help="Journal entries served per division.")
+        parser.add_argument("--new-entries", type=int, default=50, help="New entries for the incremental sync.")
+        parser.add_argument("--latency-ms", type=int, default=0, help="Latency of each ESI request.")
+        parser.add_argument("--page-size", type=int, default=2500, help="Journal entries per ESI page.")
+        parser.add_argument("--keep", action="store_true", help="Keep the synthetic data after the run.")
+
+    def handle(self, *args, **options):
+        benchmark = Benchmark(
+            owners=options["owners"],
+            history=options["history"],
+            sync_entries=options["sync_entries"],
+            new_entries=options["new_entries"],
+            latency=options["latency_ms"] / 1000,
+            page_size=options["page_size"],
+        )
+        self.stdout.write("Generating synthetic data...")
+        benchmark.setup()
+        try:
+            results = benchmark.run(options["scenarios"])
+        finally:
+            if not options["keep"]:
+                benchmark.teardown()
+
+        self.stdout.write(f"{'scenario':<22}{'seconds':>10}{'queries':>10}{'esi':>8}{'304':>6}{'peak KiB':>12}")
+        for result in results:
+            self.stdout.write(
+                f"{result['scenario']:<22}{result['seconds']:>10.3f}{result['queries']:>10}"
+                f"{result['esi_requests']:>8}{result['not_modified']:>6}{result['peak_kib']:>12.0f}"
+            )
@@ -0,0 +1,69 @@
+import sys
+from datetime import date
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...app_settings import WALLETINSIGHTS_EXPORT_CHUNK_SIZE
+from ...exports import iter_csv_lines, journal_export_queryset, write_parquet
+
+
+class Command(BaseCommand):
+    help = "Exports wallet journal entries as csv or parquet."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--corp-id", type=int, help="Only export entries of this owner corporation.")
+        parser.add_argument("--division", type=int, help="Only export entries of this division (1-7).")
+        parser.add_argument("--start", type=date.fromisoformat, help="First day to export (YYYY-MM-DD).")
+        parser.add_argument("--end", type=date.fromisoformat, help="Last day to export (YYYY-MM-DD).")
+        parser.add_argument(
+            "--ref-type",
+            action="append",
+            dest="ref_types",
+            help="Only export entries of this ref type. Can be given more than once."
+        )
+        parser.add_argument(
+            "--party-id",
+            type=int,
+            help="Only export entries where this id is the first or second party."
+        )
+        parser.add_argument("--min-amount", type=Decimal, help="Smallest amount to export.")
+        parser.add_argument("--max-amount", type=Decimal, help="Largest amount to export.")
+        parser.add_argument(
+            "--archived",
+            action="store_true",
+            help="Export entries moved to the archive by the retention task instead of the main journal."
+        )
+        parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+        parser.add_argument("--output", help="File to write to. Defaults to stdout for csv.")
+        parser.add_argument("--chunk-size", type=int, default=WALLETINSIGHTS_EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        queryset = journal_export_queryset(
+            corporation_id=options["corp_id"],
+            division_id=options["division"],
+            start=options["start"],
+            end=options["end"],
+            ref_types=options["ref_types"],
+            party_id=options["party_id"],
+            min_amount=options["min_amount"],
+            max_amount=options["max_amount"],
+            archived=options["archived"],
+        )
+
+        if options["format"] == "parquet":
+            if not options["output"]:
+                raise CommandError("--output is required for parquet exports.")
+            try:
+                written = write_parquet(queryset, options["output"], options["chunk_size"])
+            except ImportError:
+                raise CommandError("Parquet exports require pyarrow, install walletinsights[parquet].")
+            self.stderr.write(self.style.SUCCESS(f"{written} entries exported to {options['output']}."))
+            return
+
+        if options["output"]:
+            with open(options["output"], "w", newline="") as f:
+                f.writelines(iter_csv_lines(queryset, options["chunk_size"]))
+            self.stderr.write(self.style.SUCCESS(f"Entries exported to {options['output']}."))
+        else:
+            sys.stdout.writelines(iter_csv_lines(queryset, options["chunk_size"]))
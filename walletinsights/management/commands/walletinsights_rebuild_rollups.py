@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from ...models import WalletDivision, WalletJournalDailyRollup
+from ...reports import bump_journal_version
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the daily journal rollups from the stored wallet journal."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--corp-id",
+            type=int,
+            action="append",
+            dest="corp_ids",
+            help="Only rebuild rollups for this owner corporation. Can be given more than once."
+        )
+
+    def handle(self, *args, **options):
+        divisions = WalletDivision.objects.select_related("corp__corp")
+        if options["corp_ids"]:
+            divisions = divisions.filter(corp__corp__corporation_id__in=options["corp_ids"])
+
+        for division in divisions:
+            written = WalletJournalDailyRollup.objects.rebuild(WalletDivision.objects.filter(pk=division.pk))
+            bump_journal_version(division.corp_id)
+            self.stdout.write(
+                f"{division.corp.corp.corporation_name} - {division.division_name}: {written} rollup rows written."
+            )
+        self.stdout.write(self.style.SUCCESS("Rollups rebuilt."))
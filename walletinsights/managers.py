@@ -1,11 +1,45 @@
-from django.db import models
+import math
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from itertools import islice
+
+from django.core.cache import cache
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Max, Min, Q, Sum
+from django.db.models.functions import TruncDate, TruncDay, TruncHour, TruncWeek
+from django.utils.timezone import localdate, now
 
 from allianceauth.eveonline.models import EveCorporationInfo
 from allianceauth.services.hooks import get_extension_logger
+from esi.models import Token
+
+from .app_settings import (
+    WALLETINSIGHTS_JOURNAL_BATCH_SIZE,
+    WALLETINSIGHTS_OUTFLOW_ALERT_MIN_AMOUNT,
+    WALLETINSIGHTS_OUTFLOW_ALERT_MIN_SAMPLES,
+    WALLETINSIGHTS_OUTFLOW_ALERT_THRESHOLD,
+)
+from .providers import REQUIRED_SCOPES
 
 
 logger = get_extension_logger(__name__)
 
+DIVISION_CACHE_PREFIX = "walletinsights:divisions"
+DIVISION_CACHE_TTL = 60 * 60 * 24
+
+# Weight of a new outflow in the moving outflow statistics, about the last 40 outflows count.
+OUTFLOW_EWMA_ALPHA = 0.05
+
+
+def _batched(iterable, size):
+    """
+    Yield lists of at most size items from iterable.
+    """
+    it = iter(iterable)
+    while batch := list(islice(it, size)):
+        yield batch
+
 
 class OwnerManager(models.Manager):
     def get_or_create_owner(self, corp_id):
@@ -29,3 +63,559 @@ class OwnerManager(models.Manager):
         return self.create(
             corp=corp,
         )
+
+
+class OwnerCharacterManager(models.Manager):
+    def least_recently_used_tokens(self, owners):
+        """
+        Picks the valid token of the least recently used character for each owner.
+        Checking a token can refresh it through SSO, so only the tokens of the character about to be used
+        are checked, falling back to the next character if none of them is valid.
+        Characters tried before a usable one was found are marked as invalid.
+        :param owners: Owners (or owner pks) to resolve.
+        :return: dict of owner pk to Token. Owners without a valid token are left out.
+        """
+        characters = list(
+            self.filter(owner__in=owners, is_valid=True)
+            .select_related("character")
+            .order_by("last_used")
+        )
+        scoped = defaultdict(list)
+        for pk, character_id in (
+            Token.objects
+            .filter(character_id__in={char.character.character_id for char in characters})
+            .require_scopes(REQUIRED_SCOPES)
+            .values_list("pk", "character_id")
+        ):
+            scoped[character_id].append(pk)
+
+        resolved = {}
+        invalid = []
+        for char in characters:
+            if char.owner_id in resolved:
+                continue
+            token_pks = scoped.get(char.character.character_id)
+            token = None
+            if token_pks:
+                token = Token.objects.filter(pk__in=token_pks).require_valid().order_by("pk").first()
+            if token:
+                resolved[char.owner_id] = token
+            else:
+                # If we find no valid tokens for this char, mark it as invalid.
+                invalid.append(char.pk)
+        if invalid:
+            self.filter(pk__in=invalid).update(is_valid=False)
+        return resolved
+
+
+class LookupManager(models.Manager):
+    """
+    Manager of a small vocabulary stored as a lookup table, e.g. journal ref types.
+    Names are never renamed or removed, so each process keeps the ids in memory once looked up.
+    """
+    def __init__(self):
+        super().__init__()
+        self._ids = {}
+        self._names = {}
+
+    def _load(self):
+        """
+        :return: tuple of (dict of name to id, dict of id to name)
+        """
+        rows = list(self.values_list("pk", "name"))
+        ids = {name: pk for pk, name in rows}
+        names = {pk: name for pk, name in rows}
+        # Rows read inside a transaction may have been created by it, and are gone if it rolls back.
+        if not transaction.get_connection(self.db).in_atomic_block:
+            self._ids = ids
+            self._names = names
+        return ids, names
+
+    def ids_for(self, names):
+        """
+        Names not stored yet are created and committed right away. Call this outside of a transaction
+        when names may be new: names created inside one are lost if it rolls back, and names another
+        worker created at the same time may not be visible to it.
+        :param names: iterable of names, None is skipped.
+        :return: dict of name to id.
+        """
+        names = {name for name in names if name is not None}
+        ids = self._ids
+        if not names <= ids.keys():
+            ids, _ = self._load()
+            missing = names - ids.keys()
+            if missing:
+                self.bulk_create([self.model(name=name) for name in missing], ignore_conflicts=True)
+                ids, _ = self._load()
+        return {name: ids[name] for name in names}
+
+    def ids_of(self, names):
+        """
+        Ids of names that are stored, without creating the others. For filtering.
+        :param names: iterable of names.
+        :return: list of ids
+        """
+        names = set(names)
+        ids = self._ids
+        if not names <= ids.keys():
+            ids, _ = self._load()
+        return [ids[name] for name in names if name in ids]
+
+    def name_for(self, pk):
+        if pk is None:
+            return None
+        names = self._names
+        if pk not in names:
+            _, names = self._load()
+        return names.get(pk)
+
+
+class WalletDivisionManager(models.Manager):
+    def _cache_key(self, owner):
+        return f"{DIVISION_CACHE_PREFIX}:{owner.pk}"
+
+    def division_map(self, owner):
+        """
+        Divisions of an owner, cached until the divisions change.
+        :param owner:
+        :return: dict of division_id to tuple of (pk, division_name)
+        """
+        key = self._cache_key(owner)
+        divisions = cache.get(key)
+        if divisions is None:
+            divisions = {
+                division_id: (pk, name)
+                for pk, division_id, name in self.filter(corp=owner).values_list("pk", "division_id", "division_name")
+            }
+            cache.set(key, divisions, timeout=DIVISION_CACHE_TTL)
+        return divisions
+
+    def sync_names(self, owner, names):
+        """
+        Creates missing divisions and renames changed ones, leaving unchanged divisions alone.
+        :param owner:
+        :param names: dict of division_id to division_name.
+        :return: tuple of (number of divisions created, number of divisions renamed)
+        """
+        existing = {division.division_id: division for division in self.filter(corp=owner)}
+        created = [
+            self.model(corp=owner, division_id=division_id, division_name=name)
+            for division_id, name in names.items() if division_id not in existing
+        ]
+        renamed = []
+        for division_id, name in names.items():
+            division = existing.get(division_id)
+            if division is not None and division.division_name != name:
+                division.division_name = name
+                renamed.append(division)
+        if created or renamed:
+            with transaction.atomic():
+                self.bulk_create(created, ignore_conflicts=True)
+                self.bulk_update(renamed, ["division_name"])
+            cache.delete(self._cache_key(owner))
+        return len(created), len(renamed)
+
+
+class WalletJournalEntryManager(models.Manager):
+    def resolve_lookups(self, rows):
+        """
+        Creates the ref types and context id types of ESI journal rows that are not stored yet.
+        Call this before the transaction that ingests the rows, so new lookup rows are committed
+        and cached on their own.
+        :param rows: list of journal rows as returned by ESI.
+        :return:
+        """
+        from .models import ContextIdType, RefType
+
+        RefType.objects.ids_for(row["ref_type"] for row in rows)
+        ContextIdType.objects.ids_for(row.get("context_id_type") for row in rows)
+
+    def from_esi(self, division, rows):
+        """
+        Unsaved entries for ESI journal rows, with ref_type and context_id_type mapped to their lookup ids.
+        :param division: WalletDivision the rows belong to.
+        :param rows: list of journal rows as returned by ESI.
+        :return: list of entries
+        """
+        from .models import ContextIdType, RefType
+
+        ref_types = RefType.objects.ids_for(row["ref_type"] for row in rows)
+        context_id_types = ContextIdType.objects.ids_for(row.get("context_id_type") for row in rows)
+        entries = []
+        for row in rows:
+            row = dict(row)
+            entry_id = row.pop("id")
+            row["ref_type_id"] = ref_types[row.pop("ref_type")]
+            row["context_id_type_id"] = context_id_types.get(row.pop("context_id_type", None))
+            entries.append(self.model(division=division, entry_id=entry_id, **row))
+        return entries
+
+    def _insert_new(self, entries, batch_size):
+        """
+        Inserts entries and returns the ones this call stored.
+        If a concurrent sync stored some of them first, the unique (division, entry_id) constraint
+        rejects the batch, and it is inserted again row by row so the rows stored elsewhere are left out.
+        :param entries: list of unsaved entries.
+        :param batch_size:
+        :return: list of inserted entries
+        """
+        try:
+            with transaction.atomic():
+                self.bulk_create(entries, batch_size=batch_size)
+            return entries
+        except IntegrityError:
+            pass
+        inserted = []
+        for entry in entries:
+            try:
+                with transaction.atomic():
+                    self.bulk_create([entry])
+            except IntegrityError:
+                continue
+            inserted.append(entry)
+        return inserted
+
+    def bulk_ingest(self, division, entries, batch_size=WALLETINSIGHTS_JOURNAL_BATCH_SIZE):
+        """
+        Stores ESI journal rows for a division, skipping rows that are already stored.
+        Existing entry ids are looked up once per batch. Rows a concurrent sync stored in the meantime
+        are counted as skipped, so only rows stored by this call are returned as inserted.
+        :param division: WalletDivision the rows belong to.
+        :param entries: iterable of journal rows as returned by ESI.
+        :param batch_size:
+        :return: tuple of (list of inserted entries, number of skipped rows)
+        """
+        inserted = []
+        skipped = 0
+        for batch in _batched(entries, batch_size):
+            existing = set(
+                self.filter(division=division, entry_id__in=[entry["id"] for entry in batch])
+                .values_list("entry_id", flat=True)
+            )
+            new_rows = []
+            for entry in batch:
+                if entry["id"] in existing:
+                    skipped += 1
+                    continue
+                existing.add(entry["id"])
+                new_rows.append(entry)
+            new_entries = self._insert_new(self.from_esi(division, new_rows), batch_size)
+            skipped += len(new_rows) - len(new_entries)
+            inserted.extend(new_entries)
+        return inserted, skipped
+
+    def archive_older_than(self, cutoff, batch_size=WALLETINSIGHTS_JOURNAL_BATCH_SIZE):
+        """
+        Moves journal entries dated before cutoff into the archive table, one batch per transaction.
+        :param cutoff: datetime, entries older than this are archived.
+        :param batch_size:
+        :return: number of entries archived.
+        """
+        from .models import WalletJournalEntryArchive
+
+        fields = [field.attname for field in WalletJournalEntryArchive._meta.concrete_fields if not field.primary_key]
+        archived = 0
+        while True:
+            with transaction.atomic():
+                batch = list(self.filter(date__lt=cutoff).order_by("pk")[:batch_size])
+                if not batch:
+                    return archived
+                WalletJournalEntryArchive.objects.bulk_create(
+                    [WalletJournalEntryArchive(**{field: getattr(entry, field) for field in fields}) for entry in batch],
+                    ignore_conflicts=True
+                )
+                self.filter(pk__in=[entry.pk for entry in batch]).delete()
+            archived += len(batch)
+
+
+class WalletJournalDailyRollupManager(models.Manager):
+    def add_entries(self, entries, batch_size=WALLETINSIGHTS_JOURNAL_BATCH_SIZE):
+        """
+        Adds newly stored journal entries to the daily rollups.
+        The existing buckets of the entries are loaded and locked in one query and updated in bulk,
+        and missing buckets are created in bulk.
+        :param entries: iterable of WalletJournalEntry that were not counted before.
+        :param batch_size:
+        :return:
+        """
+        totals = defaultdict(lambda: {"income": Decimal(0), "expense": Decimal(0), "tax": Decimal(0), "entry_count": 0})
+        for entry in entries:
+            bucket = totals[(entry.division_id, localdate(entry.date), entry.ref_type_id)]
+            amount = entry.amount or 0
+            if amount > 0:
+                bucket["income"] += amount
+            else:
+                bucket["expense"] += amount
+            bucket["tax"] += entry.tax or 0
+            bucket["entry_count"] += 1
+        if not totals:
+            return
+
+        fields = ["income", "expense", "tax", "entry_count"]
+        with transaction.atomic():
+            # Matches a superset of the buckets, which is small as a page spans few days and ref types.
+            existing = {
+                (rollup.division_id, rollup.day, rollup.ref_type_id): rollup
+                for rollup in self.select_for_update().filter(
+                    division_id__in={key[0] for key in totals},
+                    day__in={key[1] for key in totals},
+                    ref_type_id__in={key[2] for key in totals},
+                )
+            }
+            changed = []
+            created = []
+            for (division_id, day, ref_type_id), bucket in totals.items():
+                rollup = existing.get((division_id, day, ref_type_id))
+                if rollup is None:
+                    created.append(self.model(division_id=division_id, day=day, ref_type_id=ref_type_id, **bucket))
+                    continue
+                for field in fields:
+                    setattr(rollup, field, getattr(rollup, field) + bucket[field])
+                changed.append(rollup)
+            self.bulk_update(changed, fields, batch_size=batch_size)
+
+        if not created:
+            return
+        try:
+            with transaction.atomic():
+                self.bulk_create(created, batch_size=batch_size)
+        except IntegrityError:
+            # A concurrent sync created some of the buckets since they were loaded.
+            for rollup in created:
+                self._add_to_bucket(
+                    rollup.division_id, rollup.day, rollup.ref_type_id,
+                    {field: getattr(rollup, field) for field in fields}
+                )
+
+    def _add_to_bucket(self, division_id, day, ref_type_id, bucket):
+        lookup = {"division_id": division_id, "day": day, "ref_type_id": ref_type_id}
+        increments = {field: F(field) + value for field, value in bucket.items()}
+        with transaction.atomic():
+            if self.filter(**lookup).update(**increments):
+                return
+            try:
+                with transaction.atomic():
+                    self.create(**lookup, **bucket)
+            except IntegrityError:
+                # Created by a concurrent sync since the update above.
+                self.filter(**lookup).update(**increments)
+
+    def rebuild(self, divisions):
+        """
+        Recomputes the daily rollups for divisions from the stored journal, including archived entries.
+        :param divisions: WalletDivision queryset to rebuild.
+        :return: number of rollup rows written.
+        """
+        from .models import WalletJournalEntry, WalletJournalEntryArchive
+
+        totals = defaultdict(lambda: {"income": Decimal(0), "expense": Decimal(0), "tax": Decimal(0), "entry_count": 0})
+        for model in (WalletJournalEntryArchive, WalletJournalEntry):
+            rows = (
+                model.objects
+                .filter(division__in=divisions)
+                .annotate(day=TruncDate("date"))
+                .values("division_id", "day", "ref_type_id")
+                .annotate(
+                    income=Sum("amount", filter=Q(amount__gt=0)),
+                    expense=Sum("amount", filter=Q(amount__lte=0)),
+                    tax_total=Sum("tax"),
+                    entries=Count("id"),
+                )
+                .order_by()
+            )
+            for row in rows.iterator():
+                bucket = totals[(row["division_id"], row["day"], row["ref_type_id"])]
+                bucket["income"] += row["income"] or 0
+                bucket["expense"] += row["expense"] or 0
+                bucket["tax"] += row["tax_total"] or 0
+                bucket["entry_count"] += row["entries"]
+
+        rollups = (
+            self.model(division_id=division_id, day=day, ref_type_id=ref_type_id, **bucket)
+            for (division_id, day, ref_type_id), bucket in totals.items()
+        )
+        written = 0
+        with transaction.atomic():
+            self.filter(division__in=divisions).delete()
+            for batch in _batched(rollups, WALLETINSIGHTS_JOURNAL_BATCH_SIZE):
+                self.bulk_create(batch)
+                written += len(batch)
+        return written
+
+
+class WalletBalanceRecordManager(models.Manager):
+    BUCKETS = {
+        "hour": TruncHour,
+        "day": TruncDay,
+        "week": TruncWeek,
+    }
+
+    def bucketed(self, divisions, since, bucket="day"):
+        """
+        Downsamples balance history in the database to one point per division and bucket.
+        :param divisions: WalletDivision queryset.
+        :param since: datetime of the oldest record to include.
+        :param bucket: one of hour, day or week.
+        :return: dict of division_id to a list of dicts with time, min, max and last balance per bucket.
+        """
+        grouped = (
+            self.filter(division__in=divisions, time__gte=since)
+            .annotate(bucket=self.BUCKETS[bucket]("time"))
+            .values("division_id", "division__division_id", "bucket")
+        )
+        buckets = list(
+            grouped
+            .annotate(min=Min("balance"), max=Max("balance"))
+            .order_by("division__division_id", "bucket")
+        )
+        # Records are created in time order, so the last balance of a bucket is its record with the highest id.
+        # The ids are selected by a subquery, fetching them all in one more query.
+        last = {
+            (row["division_id"], row["bucket"]): row["balance"]
+            for row in (
+                self.filter(id__in=grouped.annotate(last_id=Max("id")).values("last_id"))
+                .annotate(bucket=self.BUCKETS[bucket]("time"))
+                .values("division_id", "bucket", "balance")
+            )
+        }
+
+        series = defaultdict(list)
+        for row in buckets:
+            series[row["division__division_id"]].append({
+                "time": row["bucket"],
+                "min": row["min"],
+                "max": row["max"],
+                "last": last.get((row["division_id"], row["bucket"])),
+            })
+        return dict(series)
+
+    def compact_before(self, cutoff):
+        """
+        Downsamples records older than cutoff to the last record of each day per division.
+        :param cutoff: datetime, older records are compacted.
+        :return: number of records deleted.
+        """
+        deleted = 0
+        old_records = self.filter(time__lt=cutoff)
+        for division_id in old_records.values_list("division_id", flat=True).distinct():
+            division_records = old_records.filter(division_id=division_id)
+            keep = set(
+                division_records
+                .annotate(day=TruncDate("time"))
+                .values("day")
+                .annotate(last_id=Max("id"))
+                .values_list("last_id", flat=True)
+            )
+            with transaction.atomic():
+                count, _ = division_records.exclude(id__in=keep).delete()
+            deleted += count
+        return deleted
+
+
+class EveNameManager(models.Manager):
+    def stale_ids(self, ids, max_age, batch_size=WALLETINSIGHTS_JOURNAL_BATCH_SIZE):
+        """
+        Ids that have no stored name, or a name resolved longer than max_age seconds ago.
+        :param ids: iterable of ids.
+        :param max_age: seconds a resolved name is considered current.
+        :param batch_size:
+        :return: set of ids
+        """
+        ids = set(ids)
+        cutoff = now() - timedelta(seconds=max_age)
+        fresh = set()
+        for batch in _batched(ids, batch_size):
+            fresh.update(self.filter(id__in=batch, updated__gte=cutoff).values_list("id", flat=True))
+        return ids - fresh
+
+    def store(self, names, batch_size=WALLETINSIGHTS_JOURNAL_BATCH_SIZE):
+        """
+        Inserts or refreshes resolved names.
+        :param names: list of dicts with id, name and category, as returned by /universe/names/.
+        :param batch_size:
+        :return:
+        """
+        updated = now()
+        for batch in _batched(names, batch_size):
+            rows = {row["id"]: self.model(id=row["id"], name=row["name"], category=row["category"], updated=updated)
+                    for row in batch}
+            existing = set(self.filter(id__in=list(rows)).values_list("id", flat=True))
+            self.bulk_update(
+                [row for row in rows.values() if row.id in existing],
+                ["name", "category", "updated"],
+                batch_size=batch_size
+            )
+            self.bulk_create(
+                [row for row in rows.values() if row.id not in existing],
+                batch_size=batch_size,
+                ignore_conflicts=True
+            )
+
+    def names_for(self, ids):
+        """
+        :param ids: iterable of ids.
+        :return: dict of id to stored name, for the ids that have one.
+        """
+        ids = {id_ for id_ in ids if id_ is not None}
+        if not ids:
+            return {}
+        return dict(self.filter(id__in=ids).exclude(name="").values_list("id", "name"))
+
+
+class JournalOutflowStatsManager(models.Manager):
+    def observe(
+        self,
+        division,
+        entries,
+        threshold=WALLETINSIGHTS_OUTFLOW_ALERT_THRESHOLD,
+        min_samples=WALLETINSIGHTS_OUTFLOW_ALERT_MIN_SAMPLES,
+        min_amount=WALLETINSIGHTS_OUTFLOW_ALERT_MIN_AMOUNT
+    ):
+        """
+        Scores new outflows of a division against its running statistics, then adds them to the statistics.
+        Only the statistics of the ref types among the entries are read and written.
+        :param division:
+        :param entries: iterable of WalletJournalEntry that were not observed before.
+        :param threshold: standard deviations of log10(amount) above the mean that make an outflow unusual.
+        :param min_samples: outflows a ref type needs before it is scored.
+        :param min_amount: outflows smaller than this are never unusual.
+        :return: list of the unusual entries.
+        """
+        outflows = sorted(
+            (entry for entry in entries if entry.amount is not None and entry.amount < 0),
+            key=lambda entry: (entry.date, entry.entry_id)
+        )
+        if not outflows:
+            return []
+
+        stats = {
+            row.ref_type_id: row
+            for row in self.filter(division=division, ref_type_id__in={entry.ref_type_id for entry in outflows})
+        }
+        unusual = []
+        for entry in outflows:
+            row = stats.get(entry.ref_type_id)
+            if row is None:
+                row = stats[entry.ref_type_id] = self.model(division=division, ref_type_id=entry.ref_type_id)
+            amount = -entry.amount
+            value = math.log10(amount)
+            limit = row.mean + threshold * math.sqrt(row.variance)
+            if row.samples >= min_samples and amount >= min_amount and value > limit:
+                unusual.append(entry)
+            if row.samples == 0:
+                row.mean = value
+            else:
+                diff = value - row.mean
+                increment = OUTFLOW_EWMA_ALPHA * diff
+                row.mean += increment
+                row.variance = (1 - OUTFLOW_EWMA_ALPHA) * (row.variance + diff * increment)
+            row.samples += 1
+            row.updated = now()
+
+        with transaction.atomic():
+            self.bulk_create([row for row in stats.values() if row.pk is None], ignore_conflicts=True)
+            self.bulk_update(
+                [row for row in stats.values() if row.pk is not None],
+                ["samples", "mean", "variance", "updated"]
+            )
+        return unusual
@@ -0,0 +1,147 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from allianceauth.services.hooks import get_extension_logger
+from django.db import connection
+
+logger = get_extension_logger(__name__)
+
+COUNTERS = (
+    "esi_requests",
+    "esi_errors",
+    "pages",
+    "rows_inserted",
+    "rows_skipped",
+    "cache_hits",
+    "db_queries",
+)
+TIMERS = (
+    "esi_seconds",
+    "token_seconds",
+    "db_seconds",
+)
+
+_current = ContextVar("walletinsights_sync_metrics", default=None)
+
+
+class SyncMetrics:
+    """
+    Counters and timings collected while a sync task runs.
+    Shared with the journal fetch threads, so updates are locked.
+    """
+    def __init__(self, task):
+        self.task = task
+        self.owner = None
+        self.values = dict.fromkeys(COUNTERS, 0) | dict.fromkeys(TIMERS, 0.0)
+        self._lock = threading.Lock()
+
+    def add(self, **values):
+        with self._lock:
+            for key, value in values.items():
+                self.values[key] += value
+
+
+def current():
+    """
+    Metrics of the running sync task, or None outside of one.
+    """
+    return _current.get()
+
+
+def record(**values):
+    """
+    Add to the counters of the running sync task, if any.
+    """
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add(**values)
+
+
+def set_owner(owner):
+    """
+    Attribute the running sync task to an owner, so its stats are stored for it.
+    """
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.owner = owner
+
+
+@contextmanager
+def timed(timer, counter=None):
+    """
+    Add the time spent in the block to timer, and count it in counter.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        values = {timer: time.perf_counter() - start}
+        if counter:
+            values[counter] = 1
+        record(**values)
+
+
+def _count_queries(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record(db_queries=1, db_seconds=time.perf_counter() - start)
+
+
+@contextmanager
+def counting_queries():
+    """
+    Count the queries made on this thread's database connection during the block.
+    Django connections are per thread, so threads working for a sync task, like the
+    journal fetch threads, have to enter this themselves.
+    """
+    with connection.execute_wrapper(_count_queries):
+        yield
+
+
+def track_sync(func):
+    """
+    Collect metrics for a sync task. When done they are logged as a single structured line
+    and, if the task named its owner with set_owner, stored as the owner's last sync stats.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        metrics = SyncMetrics(func.__name__)
+        reset = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            with counting_queries():
+                return func(*args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            _current.reset(reset)
+            _store(metrics, duration)
+    return wrapper
+
+
+def _store(metrics, duration):
+    from .models import OwnerSyncStats
+
+    corporation_id = metrics.owner.corp.corporation_id if metrics.owner else None
+    logger.info("walletinsights.sync " + json.dumps({
+        "task": metrics.task,
+        "corporation_id": corporation_id,
+        "duration": round(duration, 4),
+        **{key: round(value, 4) for key, value in metrics.values.items()},
+    }))
+    if metrics.owner is None:
+        return
+    try:
+        OwnerSyncStats.objects.update_or_create(
+            owner=metrics.owner,
+            task=metrics.task,
+            defaults={"duration": duration, **metrics.values}
+        )
+    except Exception:
+        # Stats must never break a sync.
+        logger.exception(f"Failed to store sync stats for {corporation_id}")
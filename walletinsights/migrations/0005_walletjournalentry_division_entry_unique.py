@@ -0,0 +1,40 @@
+# Generated by Django 4.0.10 on 2026-10-18 09:12
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_entries(apps, schema_editor):
+    WalletJournalEntry = apps.get_model("walletinsights", "WalletJournalEntry")
+    duplicates = (
+        WalletJournalEntry.objects
+        .values("division_id", "entry_id")
+        .annotate(first_id=Min("id"), copies=Count("id"))
+        .filter(copies__gt=1)
+    )
+    for duplicate in duplicates.iterator():
+        (
+            WalletJournalEntry.objects
+            .filter(division_id=duplicate["division_id"], entry_id=duplicate["entry_id"])
+            .exclude(id=duplicate["first_id"])
+            .delete()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('walletinsights', '0004_walletjournalentry_division_entry_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_entries, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='walletjournalentry',
+            name='division_entry_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='walletjournalentry',
+            constraint=models.UniqueConstraint(fields=('division', 'entry_id'), name='division_entry_unique'),
+        ),
+    ]
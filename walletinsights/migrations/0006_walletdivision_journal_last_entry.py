@@ -0,0 +1,23 @@
+# Generated by Django 4.0.10 on 2026-10-18 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('walletinsights', '0005_walletjournalentry_division_entry_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='walletdivision',
+            name='journal_last_entry_date',
+            field=models.DateTimeField(default=None, editable=False, help_text='the date of the newest journal entry stored for this division.', null=True, verbose_name='journal last entry date'),
+        ),
+        migrations.AddField(
+            model_name='walletdivision',
+            name='journal_last_entry_id',
+            field=models.BigIntegerField(default=None, editable=False, help_text='the newest journal entry id stored for this division, used to stop paging early.', null=True, verbose_name='journal last entry id'),
+        ),
+    ]
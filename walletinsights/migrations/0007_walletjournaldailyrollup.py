@@ -0,0 +1,40 @@
+# Generated by Django 4.0.10 on 2026-10-18 11:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('walletinsights', '0006_walletdivision_journal_last_entry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletJournalDailyRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('ref_type', models.CharField(max_length=72)),
+                ('income', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('expense', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('tax', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('entry_count', models.PositiveIntegerField(default=0)),
+                ('division', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='walletinsights.walletdivision')),
+            ],
+            options={
+                'verbose_name': 'wallet journal daily rollup',
+                'verbose_name_plural': 'wallet journal daily rollups',
+                'default_permissions': (),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='walletjournaldailyrollup',
+            index=models.Index(fields=['day'], name='rollup_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='walletjournaldailyrollup',
+            constraint=models.UniqueConstraint(fields=('division', 'day', 'ref_type'), name='division_day_ref_type_unique'),
+        ),
+    ]
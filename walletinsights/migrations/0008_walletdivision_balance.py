@@ -0,0 +1,39 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:41
+
+from django.db import migrations, models
+
+
+def populate_current_balances(apps, schema_editor):
+    WalletDivision = apps.get_model("walletinsights", "WalletDivision")
+    WalletBalanceRecord = apps.get_model("walletinsights", "WalletBalanceRecord")
+    for division in WalletDivision.objects.all():
+        latest = WalletBalanceRecord.objects.filter(division=division).order_by("-time").first()
+        if latest:
+            division.balance = latest.balance
+            division.balance_updated = latest.time
+            division.save(update_fields=["balance", "balance_updated"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('walletinsights', '0007_walletjournaldailyrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='walletdivision',
+            name='balance',
+            field=models.DecimalField(decimal_places=2, default=None, editable=False, help_text='the most recently synced balance of this division.', max_digits=20, null=True, verbose_name='balance'),
+        ),
+        migrations.AddField(
+            model_name='walletdivision',
+            name='balance_updated',
+            field=models.DateTimeField(default=None, editable=False, help_text='the last time the balance of this division was updated.', null=True, verbose_name='balance updated'),
+        ),
+        migrations.AddIndex(
+            model_name='walletbalancerecord',
+            index=models.Index(fields=['division', 'time'], name='balance_division_time_idx'),
+        ),
+        migrations.RunPython(populate_current_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.0.10 on 2026-10-18 14:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('walletinsights', '0008_walletdivision_balance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletJournalEntryArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=20, null=True)),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=20, null=True)),
+                ('context_id', models.BigIntegerField(null=True)),
+                ('context_id_type', models.CharField(max_length=255, null=True)),
+                ('date', models.DateTimeField()),
+                ('description', models.CharField(max_length=500)),
+                ('first_party_id', models.IntegerField(null=True)),
+                ('entry_id', models.BigIntegerField()),
+                ('reason', models.CharField(max_length=500, null=True)),
+                ('ref_type', models.CharField(max_length=72)),
+                ('second_party_id', models.IntegerField(null=True)),
+                ('tax', models.DecimalField(decimal_places=2, max_digits=20, null=True)),
+                ('tax_receiver_id', models.IntegerField(null=True)),
+                ('division', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='walletinsights.walletdivision')),
+            ],
+            options={
+                'verbose_name': 'archived wallet journal entry',
+                'verbose_name_plural': 'archived wallet journal entries',
+                'default_permissions': (),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='walletjournalentry',
+            index=models.Index(fields=['division', 'date'], name='division_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='walletjournalentryarchive',
+            index=models.Index(fields=['division', 'date'], name='archive_division_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='walletjournalentryarchive',
+            constraint=models.UniqueConstraint(fields=('division', 'entry_id'), name='archive_division_entry_unique'),
+        ),
+    ]
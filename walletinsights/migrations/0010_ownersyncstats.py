@@ -0,0 +1,43 @@
+# Generated by Django 4.0.10 on 2026-10-18 16:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('walletinsights', '0009_walletjournalentryarchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OwnerSyncStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=64, verbose_name='task')),
+                ('last_run', models.DateTimeField(auto_now=True, verbose_name='last run')),
+                ('duration', models.FloatField(default=0, help_text='wall time in seconds', verbose_name='duration')),
+                ('esi_requests', models.PositiveIntegerField(default=0, verbose_name='ESI requests')),
+                ('esi_errors', models.PositiveIntegerField(default=0, verbose_name='ESI errors')),
+                ('esi_seconds', models.FloatField(default=0, help_text='seconds spent waiting on ESI', verbose_name='ESI time')),
+                ('token_seconds', models.FloatField(default=0, help_text='seconds spent getting valid access tokens', verbose_name='token time')),
+                ('pages', models.PositiveIntegerField(default=0, verbose_name='journal pages')),
+                ('rows_inserted', models.PositiveIntegerField(default=0, verbose_name='rows inserted')),
+                ('rows_skipped', models.PositiveIntegerField(default=0, verbose_name='rows skipped')),
+                ('cache_hits', models.PositiveIntegerField(default=0, help_text='ESI requests answered by a cached ETag', verbose_name='cache hits')),
+                ('db_queries', models.PositiveIntegerField(default=0, verbose_name='DB queries')),
+                ('db_seconds', models.FloatField(default=0, help_text='seconds spent in DB queries', verbose_name='DB time')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_stats', to='walletinsights.owner', verbose_name='owner')),
+            ],
+            options={
+                'verbose_name': 'owner sync stats',
+                'verbose_name_plural': 'owner sync stats',
+                'default_permissions': (),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='ownersyncstats',
+            constraint=models.UniqueConstraint(fields=('owner', 'task'), name='owner_task_unique'),
+        ),
+    ]
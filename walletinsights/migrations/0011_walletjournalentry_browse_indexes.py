@@ -0,0 +1,33 @@
+# Generated by Django 4.0.10 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('walletinsights', '0010_ownersyncstats'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='walletjournalentry',
+            name='division_date_idx',
+        ),
+        migrations.AddIndex(
+            model_name='walletjournalentry',
+            index=models.Index(fields=['division', 'date', 'entry_id'], name='division_date_entry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='walletjournalentry',
+            index=models.Index(fields=['division', 'ref_type', 'date'], name='division_ref_type_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='walletjournalentry',
+            index=models.Index(fields=['first_party_id', 'date'], name='first_party_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='walletjournalentry',
+            index=models.Index(fields=['second_party_id', 'date'], name='second_party_date_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.0.10 on 2026-10-18 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('walletinsights', '0011_walletjournalentry_browse_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EveName',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(blank=True, max_length=255, verbose_name='name')),
+                ('category', models.CharField(max_length=32, verbose_name='category')),
+                ('updated', models.DateTimeField(verbose_name='updated')),
+            ],
+            options={
+                'verbose_name': 'EVE name',
+                'verbose_name_plural': 'EVE names',
+                'default_permissions': (),
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.0.10 on 2026-10-18 20:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('walletinsights', '0012_evename'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='general',
+            options={'default_permissions': (), 'managed': False, 'permissions': (('access_walletinsights', 'Allows access to the WalletInsights module.'), ('all_corp_access', 'Allows access to wallet data for all corps.'), ('add_wallet_owner', 'Can add a wallet owner.'), ('outflow_alerts', 'Receives alerts about unusual wallet outflows.'))},
+        ),
+        migrations.CreateModel(
+            name='JournalOutflowStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ref_type', models.CharField(max_length=72)),
+                ('samples', models.PositiveIntegerField(default=0)),
+                ('mean', models.FloatField(default=0)),
+                ('variance', models.FloatField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('division', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='walletinsights.walletdivision')),
+            ],
+            options={
+                'verbose_name': 'journal outflow stats',
+                'verbose_name_plural': 'journal outflow stats',
+                'default_permissions': (),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='journaloutflowstats',
+            constraint=models.UniqueConstraint(fields=('division', 'ref_type'), name='outflow_division_ref_type_unique'),
+        ),
+    ]
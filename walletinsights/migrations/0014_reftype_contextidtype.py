@@ -0,0 +1,68 @@
+# Generated by Django 4.0.10 on 2026-10-18 21:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('walletinsights', '0013_journaloutflowstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefType',
+            fields=[
+                ('id', models.SmallAutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=72, unique=True)),
+            ],
+            options={
+                'verbose_name': 'ref type',
+                'verbose_name_plural': 'ref types',
+                'default_permissions': (),
+            },
+        ),
+        migrations.CreateModel(
+            name='ContextIdType',
+            fields=[
+                ('id', models.SmallAutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255, unique=True)),
+            ],
+            options={
+                'verbose_name': 'context id type',
+                'verbose_name_plural': 'context id types',
+                'default_permissions': (),
+            },
+        ),
+        migrations.AddField(
+            model_name='walletjournalentry',
+            name='ref_type_code',
+            field=models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='walletinsights.reftype'),
+        ),
+        migrations.AddField(
+            model_name='walletjournalentryarchive',
+            name='ref_type_code',
+            field=models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='walletinsights.reftype'),
+        ),
+        migrations.AddField(
+            model_name='walletjournaldailyrollup',
+            name='ref_type_code',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='walletinsights.reftype'),
+        ),
+        migrations.AddField(
+            model_name='journaloutflowstats',
+            name='ref_type_code',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='walletinsights.reftype'),
+        ),
+        migrations.AddField(
+            model_name='walletjournalentry',
+            name='context_id_type_code',
+            field=models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='walletinsights.contextidtype'),
+        ),
+        migrations.AddField(
+            model_name='walletjournalentryarchive',
+            name='context_id_type_code',
+            field=models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='walletinsights.contextidtype'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.0.10 on 2026-10-18 21:27
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+JOURNAL_MODELS = ("WalletJournalEntry", "WalletJournalEntryArchive")
+REF_TYPE_MODELS = JOURNAL_MODELS + ("WalletJournalDailyRollup", "JournalOutflowStats")
+
+
+def fill_lookup_ids(apps, schema_editor):
+    lookups = (
+        ("RefType", "ref_type", REF_TYPE_MODELS),
+        ("ContextIdType", "context_id_type", JOURNAL_MODELS),
+    )
+    for lookup_name, field, model_names in lookups:
+        lookup = apps.get_model("walletinsights", lookup_name)
+        models_ = [apps.get_model("walletinsights", name) for name in model_names]
+        names = set()
+        for model in models_:
+            names.update(
+                model.objects
+                .filter(**{f"{field}__isnull": False})
+                .order_by()
+                .values_list(field, flat=True)
+                .distinct()
+            )
+        lookup.objects.bulk_create([lookup(name=name) for name in names], ignore_conflicts=True)
+        # One UPDATE per table, resolving the id through the unique name index.
+        for model in models_:
+            model.objects.update(**{
+                f"{field}_code": Subquery(lookup.objects.filter(name=OuterRef(field)).values("pk")[:1])
+            })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('walletinsights', '0014_reftype_contextidtype'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_lookup_ids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,112 @@
+# Generated by Django 4.0.10 on 2026-10-18 21:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('walletinsights', '0015_fill_lookup_ids'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='walletjournalentry',
+            name='division_ref_type_date_idx',
+        ),
+        migrations.RemoveConstraint(
+            model_name='walletjournaldailyrollup',
+            name='division_day_ref_type_unique',
+        ),
+        migrations.RemoveConstraint(
+            model_name='journaloutflowstats',
+            name='outflow_division_ref_type_unique',
+        ),
+        migrations.RemoveField(
+            model_name='walletjournalentry',
+            name='ref_type',
+        ),
+        migrations.RemoveField(
+            model_name='walletjournalentryarchive',
+            name='ref_type',
+        ),
+        migrations.RemoveField(
+            model_name='walletjournaldailyrollup',
+            name='ref_type',
+        ),
+        migrations.RemoveField(
+            model_name='journaloutflowstats',
+            name='ref_type',
+        ),
+        migrations.RemoveField(
+            model_name='walletjournalentry',
+            name='context_id_type',
+        ),
+        migrations.RemoveField(
+            model_name='walletjournalentryarchive',
+            name='context_id_type',
+        ),
+        migrations.RenameField(
+            model_name='walletjournalentry',
+            old_name='ref_type_code',
+            new_name='ref_type',
+        ),
+        migrations.RenameField(
+            model_name='walletjournalentryarchive',
+            old_name='ref_type_code',
+            new_name='ref_type',
+        ),
+        migrations.RenameField(
+            model_name='walletjournaldailyrollup',
+            old_name='ref_type_code',
+            new_name='ref_type',
+        ),
+        migrations.RenameField(
+            model_name='journaloutflowstats',
+            old_name='ref_type_code',
+            new_name='ref_type',
+        ),
+        migrations.RenameField(
+            model_name='walletjournalentry',
+            old_name='context_id_type_code',
+            new_name='context_id_type',
+        ),
+        migrations.RenameField(
+            model_name='walletjournalentryarchive',
+            old_name='context_id_type_code',
+            new_name='context_id_type',
+        ),
+        migrations.AlterField(
+            model_name='walletjournalentry',
+            name='ref_type',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='walletinsights.reftype'),
+        ),
+        migrations.AlterField(
+            model_name='walletjournalentryarchive',
+            name='ref_type',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='walletinsights.reftype'),
+        ),
+        migrations.AlterField(
+            model_name='walletjournaldailyrollup',
+            name='ref_type',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='walletinsights.reftype'),
+        ),
+        migrations.AlterField(
+            model_name='journaloutflowstats',
+            name='ref_type',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='walletinsights.reftype'),
+        ),
+        migrations.AddIndex(
+            model_name='walletjournalentry',
+            index=models.Index(fields=['division', 'ref_type', 'date'], name='division_ref_type_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='walletjournaldailyrollup',
+            constraint=models.UniqueConstraint(fields=('division', 'day', 'ref_type'), name='division_day_ref_type_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='journaloutflowstats',
+            constraint=models.UniqueConstraint(fields=('division', 'ref_type'), name='outflow_division_ref_type_unique'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.0.10 on 2026-10-18 22:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('walletinsights', '0016_remove_walletjournalentry_division_ref_type_date_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='owner',
+            name='backfill_finished',
+            field=models.DateTimeField(blank=True, default=None, editable=False, help_text='the date and time the last journal backfill finished.', null=True, verbose_name='backfill finished'),
+        ),
+        migrations.AddField(
+            model_name='owner',
+            name='backfill_pages_done',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='journal pages stored by the current or last backfill.', verbose_name='backfill pages done'),
+        ),
+        migrations.AddField(
+            model_name='owner',
+            name='backfill_pages_total',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='journal pages of the divisions in the current or last backfill, as last reported by ESI.', verbose_name='backfill pages total'),
+        ),
+        migrations.AddField(
+            model_name='owner',
+            name='backfill_started',
+            field=models.DateTimeField(blank=True, default=None, editable=False, help_text='the date and time the current or last journal backfill started.', null=True, verbose_name='backfill started'),
+        ),
+        migrations.AddField(
+            model_name='owner',
+            name='backfill_updated',
+            field=models.DateTimeField(blank=True, default=None, editable=False, help_text='the last time the journal backfill stored a page.', null=True, verbose_name='backfill updated'),
+        ),
+        migrations.AddField(
+            model_name='walletdivision',
+            name='backfill_page',
+            field=models.PositiveIntegerField(default=None, editable=False, help_text='the next journal page the backfill imports, empty while the division is not backfilled.', null=True, verbose_name='backfill page'),
+        ),
+        migrations.AddField(
+            model_name='walletdivision',
+            name='backfill_pages',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='journal pages of this division as last reported to the backfill.', verbose_name='backfill pages'),
+        ),
+    ]
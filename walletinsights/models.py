@@ -1,10 +1,20 @@
 from allianceauth.eveonline.models import EveCorporationInfo, EveCharacter
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
 from django.db import models
 from django.utils.translation import gettext_lazy as _
-from esi.models import Token
 
-from .providers import REQUIRED_SCOPES
-from .managers import OwnerManager
+from .managers import (
+    EveNameManager, JournalOutflowStatsManager, LookupManager, OwnerCharacterManager, OwnerManager,
+    WalletBalanceRecordManager, WalletDivisionManager, WalletJournalDailyRollupManager, WalletJournalEntryManager
+)
+
+DASHBOARD_CARD_FRAGMENT = "walletinsights_owner_card"
+DASHBOARD_CARD_DATA_PREFIX = "walletinsights:owner_card"
+
+# Context id types that /universe/names/ can resolve. Other context ids, e.g. contract or market transaction ids,
+# are not names.
+NAMED_CONTEXT_ID_TYPES = ("character_id", "corporation_id", "alliance_id", "station_id", "system_id", "type_id")
 
 
 class General(models.Model):
@@ -19,7 +29,8 @@ class General(models.Model):
         permissions = (
             ("access_walletinsights", "Allows access to the WalletInsights module."),
             ("all_corp_access", "Allows access to wallet data for all corps."),
-            ("add_wallet_owner", "Can add a wallet owner.")
+            ("add_wallet_owner", "Can add a wallet owner."),
+            ("outflow_alerts", "Receives alerts about unusual wallet outflows.")
         )
 
 
@@ -52,6 +63,71 @@ class Owner(models.Model):
         help_text=_("the last date and time that wallet balances were updated.")
     )
 
+    backfill_started = models.DateTimeField(
+        null=True,
+        default=None,
+        blank=True,
+        editable=False,
+        verbose_name=_("backfill started"),
+        help_text=_("the date and time the current or last journal backfill started.")
+    )
+
+    backfill_finished = models.DateTimeField(
+        null=True,
+        default=None,
+        blank=True,
+        editable=False,
+        verbose_name=_("backfill finished"),
+        help_text=_("the date and time the last journal backfill finished.")
+    )
+
+    backfill_updated = models.DateTimeField(
+        null=True,
+        default=None,
+        blank=True,
+        editable=False,
+        verbose_name=_("backfill updated"),
+        help_text=_("the last time the journal backfill stored a page.")
+    )
+
+    backfill_pages_done = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name=_("backfill pages done"),
+        help_text=_("journal pages stored by the current or last backfill.")
+    )
+
+    backfill_pages_total = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name=_("backfill pages total"),
+        help_text=_("journal pages of the divisions in the current or last backfill, as last reported by ESI.")
+    )
+
+    @property
+    def backfill_running(self):
+        return self.backfill_started is not None and self.backfill_finished is None
+
+    @property
+    def backfill_progress(self):
+        """
+        Percentage of the running journal backfill that is done, or None if no backfill is running.
+        """
+        if not self.backfill_running:
+            return None
+        if not self.backfill_pages_total:
+            return 0
+        return min(self.backfill_pages_done * 100 // self.backfill_pages_total, 100)
+
+    def invalidate_dashboard_card(self):
+        """
+        Drop the cached dashboard card for this owner, so it is rendered from fresh data.
+        """
+        cache.delete_many([
+            make_template_fragment_key(DASHBOARD_CARD_FRAGMENT, [self.pk]),
+            f"{DASHBOARD_CARD_DATA_PREFIX}:{self.pk}",
+        ])
+
     class Meta:
         default_permissions = (())
         verbose_name = _("owner")
@@ -62,6 +138,9 @@ class OwnerCharacter(models.Model):
     """
     Character to be used to sync data for related owner.
     """
+
+    objects = OwnerCharacterManager()
+
     owner = models.ForeignKey(
         to=Owner,
         on_delete=models.CASCADE,
@@ -90,17 +169,6 @@ class OwnerCharacter(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
-    def valid_token(self):
-        """
-        Provide a token, or return None if one can not be found.
-        """
-        return (
-            Token.objects.filter(character_id=self.character.character_id)
-            .require_scopes(REQUIRED_SCOPES)
-            .require_valid()
-            .first()
-        )
-
     class Meta:
         default_permissions = (())
         verbose_name = _("owner character")
@@ -121,6 +189,51 @@ class WalletDivision(models.Model):
         verbose_name=_("journal last updated"),
         help_text=_("the last time the journal for this division was updated.")
     )
+    journal_last_entry_id = models.BigIntegerField(
+        null=True,
+        default=None,
+        editable=False,
+        verbose_name=_("journal last entry id"),
+        help_text=_("the newest journal entry id stored for this division, used to stop paging early.")
+    )
+    journal_last_entry_date = models.DateTimeField(
+        null=True,
+        default=None,
+        editable=False,
+        verbose_name=_("journal last entry date"),
+        help_text=_("the date of the newest journal entry stored for this division.")
+    )
+    balance = models.DecimalField(
+        max_digits=20,
+        decimal_places=2,
+        null=True,
+        default=None,
+        editable=False,
+        verbose_name=_("balance"),
+        help_text=_("the most recently synced balance of this division.")
+    )
+    balance_updated = models.DateTimeField(
+        null=True,
+        default=None,
+        editable=False,
+        verbose_name=_("balance updated"),
+        help_text=_("the last time the balance of this division was updated.")
+    )
+    backfill_page = models.PositiveIntegerField(
+        null=True,
+        default=None,
+        editable=False,
+        verbose_name=_("backfill page"),
+        help_text=_("the next journal page the backfill imports, empty while the division is not backfilled.")
+    )
+    backfill_pages = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name=_("backfill pages"),
+        help_text=_("journal pages of this division as last reported to the backfill.")
+    )
+
+    objects = WalletDivisionManager()
 
     class Meta:
         default_permissions = (())
@@ -139,6 +252,9 @@ class WalletBalanceRecord(models.Model):
     """
     Supplied by /corporations/{corporation_id}/wallets/
     """
+
+    objects = WalletBalanceRecordManager()
+
     division = models.ForeignKey(to=WalletDivision, on_delete=models.CASCADE)
     balance = models.DecimalField(max_digits=20, decimal_places=2, null=False)
     time = models.DateTimeField(auto_now_add=True)
@@ -147,9 +263,42 @@ class WalletBalanceRecord(models.Model):
         default_permissions = (())
         verbose_name = _("wallet balance record")
         verbose_name_plural = _("wallet balance records")
+        indexes = [
+            models.Index(fields=["division", "time"], name="balance_division_time_idx"),
+        ]
 
 
-class WalletJournalEntry(models.Model):
+class RefType(models.Model):
+    """
+    Journal ref types, e.g. player_donation. Journal rows reference them by id rather than repeating the name.
+    """
+    id = models.SmallAutoField(primary_key=True)
+    name = models.CharField(max_length=72, unique=True)
+
+    objects = LookupManager()
+
+    class Meta:
+        default_permissions = (())
+        verbose_name = _("ref type")
+        verbose_name_plural = _("ref types")
+
+
+class ContextIdType(models.Model):
+    """
+    Journal context id types, e.g. market_transaction_id.
+    """
+    id = models.SmallAutoField(primary_key=True)
+    name = models.CharField(max_length=255, unique=True)
+
+    objects = LookupManager()
+
+    class Meta:
+        default_permissions = (())
+        verbose_name = _("context id type")
+        verbose_name_plural = _("context id types")
+
+
+class JournalEntryBase(models.Model):
     """
     Supplied by /corporations/{corporation_id}/wallets/{division}/journal/
     """
@@ -157,21 +306,193 @@ class WalletJournalEntry(models.Model):
     amount = models.DecimalField(max_digits=20, decimal_places=2, null=True)
     balance = models.DecimalField(max_digits=20, decimal_places=2, null=True)
     context_id = models.BigIntegerField(null=True)
-    context_id_type = models.CharField(max_length=255, null=True)
+    # Lookup ids are not indexed or constrained on their own, which would add an index per column
+    # to the largest tables. Lookup rows are never deleted.
+    context_id_type = models.ForeignKey(
+        to=ContextIdType,
+        on_delete=models.PROTECT,
+        null=True,
+        related_name="+",
+        db_index=False,
+        db_constraint=False
+    )
     date = models.DateTimeField(null=False)
     description = models.CharField(max_length=500, null=False)
     first_party_id = models.IntegerField(null=True)
     entry_id = models.BigIntegerField(null=False)
     reason = models.CharField(max_length=500, null=True)
-    ref_type = models.CharField(max_length=72, null=False)
+    ref_type = models.ForeignKey(
+        to=RefType,
+        on_delete=models.PROTECT,
+        related_name="+",
+        db_index=False,
+        db_constraint=False
+    )
     second_party_id = models.IntegerField(null=True)
     tax = models.DecimalField(max_digits=20, decimal_places=2, null=True)
     tax_receiver_id = models.IntegerField(null=True)
 
+    class Meta:
+        abstract = True
+
+    def named_ids(self):
+        """
+        Ids of the entry that can be resolved to names.
+        :return: set of ids
+        """
+        ids = {self.first_party_id, self.second_party_id, self.tax_receiver_id}
+        if ContextIdType.objects.name_for(self.context_id_type_id) in NAMED_CONTEXT_ID_TYPES:
+            ids.add(self.context_id)
+        ids.discard(None)
+        return ids
+
+
+class WalletJournalEntry(JournalEntryBase):
+    """
+    Journal entries within the retention period, which are the ones syncs and reports work on.
+    """
+
+    objects = WalletJournalEntryManager()
+
     class Meta:
         default_permissions = (())
         verbose_name = _("wallet journal entry")
         verbose_name_plural = _("wallet journal entries")
+        constraints = [
+            models.UniqueConstraint(fields=["division", "entry_id"], name="division_entry_unique"),
+        ]
         indexes = [
-            models.Index(fields=["division", "entry_id"], name="division_entry_idx"),
+            models.Index(fields=["division", "date", "entry_id"], name="division_date_entry_idx"),
+            models.Index(fields=["division", "ref_type", "date"], name="division_ref_type_date_idx"),
+            models.Index(fields=["first_party_id", "date"], name="first_party_date_idx"),
+            models.Index(fields=["second_party_id", "date"], name="second_party_date_idx"),
         ]
+
+
+class WalletJournalEntryArchive(JournalEntryBase):
+    """
+    Journal entries older than the retention period, moved out of the main journal table.
+    """
+
+    class Meta:
+        default_permissions = (())
+        verbose_name = _("archived wallet journal entry")
+        verbose_name_plural = _("archived wallet journal entries")
+        constraints = [
+            models.UniqueConstraint(fields=["division", "entry_id"], name="archive_division_entry_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["division", "date"], name="archive_division_date_idx"),
+        ]
+
+
+class WalletJournalDailyRollup(models.Model):
+    """
+    Daily journal totals per division and ref type, maintained as journal entries are synced.
+    """
+
+    objects = WalletJournalDailyRollupManager()
+
+    division = models.ForeignKey(to=WalletDivision, on_delete=models.CASCADE)
+    day = models.DateField()
+    ref_type = models.ForeignKey(to=RefType, on_delete=models.PROTECT, related_name="+")
+    income = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    expense = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    tax = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    entry_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        default_permissions = (())
+        verbose_name = _("wallet journal daily rollup")
+        verbose_name_plural = _("wallet journal daily rollups")
+        constraints = [
+            models.UniqueConstraint(fields=["division", "day", "ref_type"], name="division_day_ref_type_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["day"], name="rollup_day_idx"),
+        ]
+
+
+class JournalOutflowStats(models.Model):
+    """
+    Running statistics of the outflows of a division per ref type, updated as journal entries are synced.
+    Outflows are tracked as log10 of the amount in exponentially weighted moving averages, so each sync only
+    has to look at its new entries.
+    """
+
+    objects = JournalOutflowStatsManager()
+
+    division = models.ForeignKey(to=WalletDivision, on_delete=models.CASCADE)
+    ref_type = models.ForeignKey(to=RefType, on_delete=models.PROTECT, related_name="+")
+    samples = models.PositiveIntegerField(default=0)
+    mean = models.FloatField(default=0)
+    variance = models.FloatField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        default_permissions = (())
+        verbose_name = _("journal outflow stats")
+        verbose_name_plural = _("journal outflow stats")
+        constraints = [
+            models.UniqueConstraint(fields=["division", "ref_type"], name="outflow_division_ref_type_unique"),
+        ]
+
+
+class OwnerSyncStats(models.Model):
+    """
+    Metrics of the last run of a sync task for an owner.
+    """
+    owner = models.ForeignKey(
+        to=Owner,
+        on_delete=models.CASCADE,
+        related_name="sync_stats",
+        verbose_name=_("owner")
+    )
+    task = models.CharField(max_length=64, verbose_name=_("task"))
+    last_run = models.DateTimeField(auto_now=True, verbose_name=_("last run"))
+    duration = models.FloatField(default=0, verbose_name=_("duration"), help_text=_("wall time in seconds"))
+    esi_requests = models.PositiveIntegerField(default=0, verbose_name=_("ESI requests"))
+    esi_errors = models.PositiveIntegerField(default=0, verbose_name=_("ESI errors"))
+    esi_seconds = models.FloatField(default=0, verbose_name=_("ESI time"), help_text=_("seconds spent waiting on ESI"))
+    token_seconds = models.FloatField(
+        default=0,
+        verbose_name=_("token time"),
+        help_text=_("seconds spent getting valid access tokens")
+    )
+    pages = models.PositiveIntegerField(default=0, verbose_name=_("journal pages"))
+    rows_inserted = models.PositiveIntegerField(default=0, verbose_name=_("rows inserted"))
+    rows_skipped = models.PositiveIntegerField(default=0, verbose_name=_("rows skipped"))
+    cache_hits = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("cache hits"),
+        help_text=_("ESI requests answered by a cached ETag")
+    )
+    db_queries = models.PositiveIntegerField(default=0, verbose_name=_("DB queries"))
+    db_seconds = models.FloatField(default=0, verbose_name=_("DB time"), help_text=_("seconds spent in DB queries"))
+
+    class Meta:
+        default_permissions = (())
+        verbose_name = _("owner sync stats")
+        verbose_name_plural = _("owner sync stats")
+        constraints = [
+            models.UniqueConstraint(fields=["owner", "task"], name="owner_task_unique"),
+        ]
+
+
+class EveName(models.Model):
+    """
+    Names of ids found in the journal, resolved through /universe/names/ and refreshed after
+    WALLETINSIGHTS_NAME_TTL. Ids ESI could not resolve are stored with an empty name, so they are not retried
+    on every sync.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    name = models.CharField(max_length=255, blank=True, verbose_name=_("name"))
+    category = models.CharField(max_length=32, verbose_name=_("category"))
+    updated = models.DateTimeField(verbose_name=_("updated"))
+
+    objects = EveNameManager()
+
+    class Meta:
+        default_permissions = (())
+        verbose_name = _("EVE name")
+        verbose_name_plural = _("EVE names")
@@ -0,0 +1,107 @@
+import hashlib
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db.models import Sum
+
+from .app_settings import WALLETINSIGHTS_ANALYTICS_CACHE_TTL
+from .models import RefType, WalletJournalDailyRollup
+
+JOURNAL_VERSION_PREFIX = "walletinsights:journal_version"
+REPORT_CACHE_PREFIX = "walletinsights:report"
+
+
+def _journal_version_key(owner_pk, month=None):
+    if month is None:
+        return f"{JOURNAL_VERSION_PREFIX}:{owner_pk}"
+    return f"{JOURNAL_VERSION_PREFIX}:{owner_pk}:{month:%Y-%m}"
+
+
+def _journal_epoch_key(owner_pk):
+    return f"{JOURNAL_VERSION_PREFIX}:{owner_pk}:epoch"
+
+
+def _bump(key):
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add and incr.
+        cache.set(key, 1, timeout=None)
+
+
+def bump_journal_version(owner_pk, months=None):
+    """
+    Mark the journal of an owner as changed, invalidating every cached report that includes it.
+    :param owner_pk:
+    :param months: first days of the months that received new rows, only their cached monthly
+    pieces are invalidated. None invalidates every month, e.g. after the rollups were rebuilt.
+    """
+    _bump(_journal_version_key(owner_pk))
+    if months is None:
+        _bump(_journal_epoch_key(owner_pk))
+        return
+    for month in months:
+        _bump(_journal_version_key(owner_pk, month))
+
+
+def month_cache_keys(name, owner_pk, months):
+    """
+    Cache keys of the monthly pieces of a report. A month's key changes once the owner syncs new rows for it.
+    :return: dict of month to cache key.
+    """
+    version_keys = {month: _journal_version_key(owner_pk, month) for month in months}
+    versions = cache.get_many([*version_keys.values(), _journal_epoch_key(owner_pk)])
+    epoch = versions.get(_journal_epoch_key(owner_pk), 0)
+    return {
+        month: f"{REPORT_CACHE_PREFIX}:{name}:{owner_pk}:{month:%Y-%m}@{versions.get(key, 0)}@{epoch}"
+        for month, key in version_keys.items()
+    }
+
+
+def _report_cache_key(name, owner_pks, start, end):
+    versions = cache.get_many([_journal_version_key(pk) for pk in owner_pks])
+    parts = [f"{pk}@{versions.get(_journal_version_key(pk), 0)}" for pk in owner_pks]
+    digest = hashlib.md5(f"{','.join(parts)}|{start}|{end}".encode()).hexdigest()
+    return f"{REPORT_CACHE_PREFIX}:{name}:{digest}"
+
+
+def ref_type_breakdown(owners, start, end):
+    """
+    Income, expense and tax per owner and ref type between start and end, from a single grouped
+    query over the daily rollups. Results are cached until one of the owners syncs new journal rows.
+    :param owners: Owners to include.
+    :param start: first day.
+    :param end: last day.
+    :return: dict of owner pk to a dict of ref type to totals.
+    """
+    owner_pks = sorted(owner.pk for owner in owners)
+    cache_key = _report_cache_key("ref_type_breakdown", owner_pks, start, end)
+    breakdown = cache.get(cache_key)
+    if breakdown is not None:
+        return breakdown
+
+    rows = (
+        WalletJournalDailyRollup.objects
+        .filter(division__corp__in=owner_pks, day__gte=start, day__lte=end)
+        .values("division__corp", "ref_type")
+        .annotate(
+            income=Sum("income"),
+            expense=Sum("expense"),
+            tax=Sum("tax"),
+            entries=Sum("entry_count"),
+        )
+        .order_by()
+    )
+    breakdown = defaultdict(dict)
+    for row in rows:
+        breakdown[row["division__corp"]][RefType.objects.name_for(row["ref_type"])] = {
+            "income": row["income"],
+            "expense": row["expense"],
+            "net": row["income"] + row["expense"],
+            "tax": row["tax"],
+            "entries": row["entries"],
+        }
+    breakdown = dict(breakdown)
+    cache.set(cache_key, breakdown, timeout=WALLETINSIGHTS_ANALYTICS_CACHE_TTL)
+    return breakdown
@@ -1,166 +1,484 @@
+import random
+import time
 from datetime import timedelta
 
 from allianceauth.services.hooks import get_extension_logger
 from celery import shared_task, chain
-from django.utils.timezone import now
+from django.db import transaction
+from django.db.models import F
+from django.utils.timezone import localdate, now
 from esi.models import Token
 
-from .providers import esi
-from .models import Owner, OwnerCharacter, WalletDivision, WalletBalanceRecord, WalletJournalEntry
+from .alerts import notify_outflows
+from .app_settings import (
+    WALLETINSIGHTS_BACKFILL_CHUNK_DELAY, WALLETINSIGHTS_BACKFILL_CHUNK_PAGES, WALLETINSIGHTS_BALANCE_COMPACT_AFTER_DAYS,
+    WALLETINSIGHTS_BULK_PRIORITY, WALLETINSIGHTS_BULK_QUEUE, WALLETINSIGHTS_BULK_RATE_LIMIT,
+    WALLETINSIGHTS_FAST_PRIORITY, WALLETINSIGHTS_FAST_QUEUE, WALLETINSIGHTS_JOURNAL_RETENTION_DAYS,
+    WALLETINSIGHTS_NAME_TTL, WALLETINSIGHTS_SYNC_INTERVAL, WALLETINSIGHTS_SYNC_LOCK_TIMEOUT
+)
+from .fetch import (
+    NAMES_BATCH_SIZE, TOKEN_ERRORS, TRANSIENT_ERRORS, EsiRateLimited, NotModified, clear_journal_checkpoint,
+    etag_cache_key, fetch_balances, fetch_divisions, fetch_names, iter_journal_page_range, iter_journal_pages,
+    iter_owner_journal_pages, next_fetch_at, save_journal_checkpoint, store_etag
+)
+from .locks import clear_queued, mark_queued, owner_locked
+from .metrics import record, set_owner, track_sync
+from .models import (
+    EveName, JournalOutflowStats, Owner, OwnerCharacter, WalletDivision, WalletBalanceRecord, WalletJournalEntry,
+    WalletJournalDailyRollup
+)
+from .reports import bump_journal_version
 
 logger = get_extension_logger(__name__)
 
+# Rate limited tasks are retried a little later rather than failed.
+RATE_LIMITED_MAX_RETRIES = 20
 
-def __get_least_recently_used_token(owner_corp_id):
+# Tasks failing on ESI outages are retried with exponential backoff, starting at BACKOFF_BASE seconds.
+TRANSIENT_MAX_RETRIES = 5
+BACKOFF_BASE = 30
+BACKOFF_MAX = 60 * 15
+
+# Errors a sync task is retried for rather than failed.
+RETRY_ERRORS = (EsiRateLimited, *TRANSIENT_ERRORS, *TOKEN_ERRORS)
+
+# Cheap, latency sensitive tasks run on the fast lane, so journal backfills on the bulk lane can not hold them up.
+FAST_LANE = {"queue": WALLETINSIGHTS_FAST_QUEUE, "priority": WALLETINSIGHTS_FAST_PRIORITY}
+BULK_LANE = {
+    "queue": WALLETINSIGHTS_BULK_QUEUE,
+    "priority": WALLETINSIGHTS_BULK_PRIORITY,
+    "rate_limit": WALLETINSIGHTS_BULK_RATE_LIMIT,
+}
+
+# ESI serves 30 days of journal, entries must stay in the main table a little longer than that
+# so they are still seen when de-duplicating.
+MIN_JOURNAL_RETENTION_DAYS = 35
+
+
+def _get_owner(owner_corp_id):
+    return Owner.objects.select_related("corp").get(corp__corporation_id=owner_corp_id)
+
+
+def _get_token(owner, token_id=None):
     """
-    Returns the token for the owner that has been used least recently.
-    :param owner_corp_id:
-    :return:
+    Returns the given token, or the token for the owner that has been used least recently.
+    The given token is skipped if it was deleted or its character was marked invalid since the task was queued,
+    e.g. when an earlier step of the same chain failed over to another token.
+    :param owner:
+    :param token_id: default: None
+    :return: Token, or None if the owner has no valid token.
     """
-    chars = (
-        OwnerCharacter
-        .objects
-        .filter(owner__corp__corporation_id=owner_corp_id)
-        .exclude(is_valid=False)
-        .order_by("last_used")
+    if token_id:
+        token = Token.objects.filter(pk=token_id).first()
+        if token is not None and OwnerCharacter.objects.filter(
+            owner=owner, character__character_id=token.character_id, is_valid=True
+        ).exists():
+            return token
+        logger.info(f"Token {token_id} is no longer valid. Using the next token of the owner.")
+    return OwnerCharacter.objects.least_recently_used_tokens([owner]).get(owner.pk)
+
+
+def _retry_later(task, error, token=None):
+    """
+    Retry a task after a failed ESI request, with some jitter so retries do not arrive together.
+    Rate limited tasks are retried once requests are allowed again. When ESI refused the token,
+    its character is marked invalid and the task is retried right away with the next valid token.
+    Anything else is retried with exponential backoff.
+    The task must take token_id as a keyword argument.
+    :param task: bound task.
+    :param error: one of RETRY_ERRORS.
+    :param token: Token the task used, default: None
+    """
+    if isinstance(error, EsiRateLimited):
+        raise task.retry(
+            countdown=error.retry_after + random.randint(0, 15),
+            exc=error,
+            max_retries=RATE_LIMITED_MAX_RETRIES
+        )
+    if token is not None and isinstance(error, TOKEN_ERRORS):
+        logger.warning(f"Token of character {token.character_id} refused: {error}. Failing over to the next token.")
+        OwnerCharacter.objects.filter(character__character_id=token.character_id).update(is_valid=False)
+        raise task.retry(
+            kwargs={**task.request.kwargs, "token_id": None},
+            countdown=0,
+            exc=error,
+            max_retries=RATE_LIMITED_MAX_RETRIES
+        )
+    backoff = min(BACKOFF_BASE * 2 ** task.request.retries, BACKOFF_MAX)
+    raise task.retry(
+        countdown=random.randint(backoff // 2, backoff),
+        exc=error,
+        max_retries=TRANSIENT_MAX_RETRIES
     )
 
-    token = None
-    for char in chars:
-        token = char.valid_token()
-        if token:
-            break
-        else:
-            # If we find no valid tokens for this char, mark it as invalid.
-            char.is_valid = False
-            char.save()
 
-    return token
+def queue_owner_update(owner_corp_id, token_id=None, countdown=0):
+    """
+    Queue update_owner for an owner, unless an update for it is already queued.
+    :param owner_corp_id:
+    :param token_id: default: None
+    :param countdown: default: 0
+    :return: True if the update was queued.
+    """
+    if not mark_queued(owner_corp_id, timeout=countdown + WALLETINSIGHTS_SYNC_LOCK_TIMEOUT):
+        logger.debug(f"Update for {owner_corp_id} already queued. Skipping.")
+        return False
+    update_owner.apply_async(args=[owner_corp_id], kwargs={"token_id": token_id}, countdown=countdown)
+    return True
+
+
+def _division_name(division_id, name=None):
+    # 1st division never returns a name and is always the master wallet.
+    if division_id == 1:
+        return "Master Wallet"
+    return name or f"Division {division_id}"
 
 
-@shared_task()
+@shared_task(**FAST_LANE)
+@track_sync
 def update_all_owners():
     """
     Update wallet data for all owners.
     :return:
     """
     logger.debug("Update all owners task started!")
-    owners = Owner.objects.all()
-    for owner in owners:
-        update_owner.delay(owner.corp.corporation_id)
-
-
-@shared_task()
-def update_owner(owner_corp_id):
+    owners = list(Owner.objects.filter(is_active=True).select_related("corp"))
+    if not owners:
+        return
+    tokens = OwnerCharacter.objects.least_recently_used_tokens(owners)
+
+    # Spread the owners over the sync interval, with each owner at a random point of its own slot,
+    # so the ESI requests are not all sent at the top of the hour.
+    slot = WALLETINSIGHTS_SYNC_INTERVAL / len(owners)
+    for i, owner in enumerate(owners):
+        countdown = int(i * slot + random.uniform(0, slot))
+        expires = next_fetch_at(etag_cache_key("wallets", owner.corp.corporation_id))
+        if expires and expires > now().timestamp() + countdown:
+            logger.debug(f"Wallet data for {owner.corp.corporation_id} not yet expired. Skipping.")
+            continue
+        if owner.pk not in tokens:
+            logger.warning(f"No valid token for {owner.corp.corporation_id}. Skipping.")
+            continue
+        queue_owner_update(owner.corp.corporation_id, tokens[owner.pk].pk, countdown=countdown)
+
+
+@shared_task(**FAST_LANE)
+@track_sync
+def update_owner(owner_corp_id, token_id=None):
     """
     Update wallet data for a specific owner.
     :param owner_corp_id:
+    :param token_id: default: None
     :return:
     """
     logger.debug(f"Updating wallet data for owner {owner_corp_id}")
-    owner = Owner.objects.get(corp__corporation_id=owner_corp_id)
+    # Let the next update be queued as soon as this one starts.
+    clear_queued(owner_corp_id)
+    owner = _get_owner(owner_corp_id)
     if not owner.is_active:
         logger.debug(f"{owner_corp_id} marked as not active. Skipping.")
         return
-    token = __get_least_recently_used_token(owner_corp_id)
-    chain(update_owner_divisions.si(owner_corp_id, token.pk), update_owner_journals.si(owner_corp_id, token.pk)).delay()
+    token = _get_token(owner, token_id)
+    if token is None:
+        logger.warning(f"No valid token for {owner_corp_id}. Skipping.")
+        return
+    chain(
+        update_owner_divisions.si(owner_corp_id, token_id=token.pk),
+        update_owner_journals.si(owner_corp_id, token_id=token.pk)
+    ).delay()
 
 
-@shared_task()
-def update_owner_divisions(owner_corp_id, token_id=None):
+@shared_task(bind=True, **FAST_LANE)
+@track_sync
+@owner_locked("divisions")
+def update_owner_divisions(self, owner_corp_id, token_id=None):
     """
     Update wallet divisions for an owner
     :param owner_corp_id:
     :param token_id: default: None
     :return:
     """
-    owner = Owner.objects.get(corp__corporation_id=owner_corp_id)
-    if not token_id:
-        token = __get_least_recently_used_token(owner_corp_id)
-    else:
-        token = Token.objects.get(pk=token_id)
-
-    if owner.balances_last_updated is None or owner.balances_last_updated + timedelta(hours=1) <= now():
-        # Only request new division name data if the cache is expired. (Division names are cached for 3600s)
-        division_data = esi.client.Corporation.get_corporations_corporation_id_divisions(
-            corporation_id=owner_corp_id,
-            token=token.valid_access_token()
-        ).result()
+    owner = _get_owner(owner_corp_id)
+    set_owner(owner)
+    token = _get_token(owner, token_id)
+    if token is None:
+        logger.warning(f"No valid token for {owner_corp_id}. Skipping.")
+        return
 
-        for division in division_data["wallet"]:
-            # 1st division never returns a name and is always the master wallet.
-            if division["division"] == 1:
-                division["name"] = "Master Wallet"
-            elif "name" not in list(division.keys()) or division["name"] is None:
-                division["name"] = f"Division {division['division']}"
-            WalletDivision.objects.update_or_create(
-                corp=owner,
-                division_id=division["division"],
-                division_name=division["name"]
-            )
+    try:
+        division_data, headers = fetch_divisions(owner_corp_id, token)
+    except RETRY_ERRORS as e:
+        _retry_later(self, e, token)
+    except NotModified:
+        logger.debug(f"Divisions for {owner_corp_id} unchanged.")
+    else:
+        created, renamed = WalletDivision.objects.sync_names(owner, {
+            division["division"]: _division_name(division["division"], division.get("name"))
+            for division in division_data["wallet"]
+        })
+        store_etag(etag_cache_key("divisions", owner_corp_id), headers)
+        logger.debug(f"Divisions for {owner_corp_id}: {created} created, {renamed} renamed.")
 
-    update_division_balances.delay(owner_corp_id, token.pk)
+    update_division_balances.delay(owner_corp_id, token_id=token.pk)
 
 
-@shared_task()
-def update_division_balances(owner_corp_id, token_id=None):
+@shared_task(bind=True, **FAST_LANE)
+@track_sync
+@owner_locked("balances")
+def update_division_balances(self, owner_corp_id, token_id=None):
     """
     Updates the balances for wallet divisions.
     :param owner_corp_id:
     :param token_id: default: None
     :return:
     """
-    if not token_id:
-        token = __get_least_recently_used_token(owner_corp_id)
-    else:
-        token = Token.objects.get(pk=token_id)
-    divisions = WalletDivision.objects.filter(corp__corp__corporation_id=owner_corp_id).order_by("division_id")
+    owner = _get_owner(owner_corp_id)
+    set_owner(owner)
+    token = _get_token(owner, token_id)
+    if token is None:
+        logger.warning(f"No valid token for {owner_corp_id}. Skipping.")
+        return
 
-    data = esi.client.Wallet.get_corporations_corporation_id_wallets(
-        corporation_id=owner_corp_id,
-        token=token.valid_access_token()
-    ).result()
+    try:
+        data, headers = fetch_balances(owner_corp_id, token)
+    except RETRY_ERRORS as e:
+        _retry_later(self, e, token)
+    except NotModified:
+        logger.debug(f"Balances for {owner_corp_id} unchanged.")
+        return
 
-    for d in data:
-        division = divisions[d["division"]-1]
-        balance = d["balance"]
-        WalletBalanceRecord.objects.create(
-            division=division,
-            balance=balance
-        )
+    divisions = WalletDivision.objects.division_map(owner)
+    missing = [d["division"] for d in data if d["division"] not in divisions]
+    if missing:
+        # Balances can arrive before the divisions were ever synced.
+        WalletDivision.objects.sync_names(owner, {division_id: _division_name(division_id) for division_id in missing})
+        divisions = WalletDivision.objects.division_map(owner)
 
-    owner = divisions[1].corp
-    owner.balances_last_updated = now()
-    owner.save()
+    updated = now()
+    records = []
+    changed = []
+    for d in data:
+        pk, _ = divisions[d["division"]]
+        records.append(WalletBalanceRecord(division_id=pk, balance=d["balance"]))
+        changed.append(WalletDivision(pk=pk, balance=d["balance"], balance_updated=updated))
+
+    with transaction.atomic():
+        WalletBalanceRecord.objects.bulk_create(records)
+        WalletDivision.objects.bulk_update(changed, ["balance", "balance_updated"])
+        owner.balances_last_updated = updated
+        owner.save(update_fields=["balances_last_updated"])
+    store_etag(etag_cache_key("wallets", owner_corp_id), headers)
+    owner.invalidate_dashboard_card()
 
     update_ownerchar_last_used.delay(token.character_id)
 
 
-@shared_task()
-def update_owner_journals(owner_corp_id, token_id=None):
+def _store_journal_pages(division, pages):
+    """
+    Stores journal pages for a division. Every page is committed and checkpointed on its own,
+    so a sync that fails part way keeps and resumes after the pages it stored.
+    :param division:
+    :param pages: iterator of (page number, new journal rows) for the division, newest first.
+    :return: tuple of (number of inserted rows, number of skipped rows)
+    :raises NotModified: if the journal has not changed since the last sync.
+    """
+    inserted_count = 0
+    skipped_count = 0
+    named_ids = set()
+    months = set()
+    unusual = []
+    try:
+        for page, entries in pages:
+            WalletJournalEntry.objects.resolve_lookups(entries)
+            with transaction.atomic():
+                inserted, skipped = WalletJournalEntry.objects.bulk_ingest(division, entries)
+                WalletJournalDailyRollup.objects.add_entries(inserted)
+                unusual += JournalOutflowStats.objects.observe(division, inserted)
+            record(rows_inserted=len(inserted), rows_skipped=skipped)
+            save_journal_checkpoint(division, page)
+            inserted_count += len(inserted)
+            skipped_count += skipped
+            named_ids.update(*(entry.named_ids() for entry in inserted))
+            months.update(localdate(entry.date).replace(day=1) for entry in inserted)
+    finally:
+        # Pages stored before a failure are visible too.
+        if inserted_count:
+            division.corp.invalidate_dashboard_card()
+            bump_journal_version(division.corp_id, months)
+            unnamed = EveName.objects.stale_ids(named_ids, WALLETINSIGHTS_NAME_TTL)
+            if unnamed:
+                resolve_names.delay(sorted(unnamed))
+        # The first sync of a division only trains the outflow statistics on its history.
+        if unusual and division.journal_last_entry_id is not None:
+            send_outflow_alerts.delay(division.pk, [entry.entry_id for entry in unusual])
+    return inserted_count, skipped_count
+
+
+def _finish_division_journal(division):
+    """
+    Moves the high-water mark of a division to the newest stored entry, once every page down to
+    the previous mark was stored.
+    :param division:
+    :return:
+    """
+    newest = (
+        WalletJournalEntry.objects
+        .filter(division=division)
+        .order_by("-entry_id")
+        .values("entry_id", "date")
+        .first()
+    )
+    if newest:
+        division.journal_last_entry_id = newest["entry_id"]
+        division.journal_last_entry_date = newest["date"]
+    division.journal_last_updated = now()
+    division.save()
+    clear_journal_checkpoint(division)
+
+
+def _store_division_journal(owner_corp_id, division, pages):
+    """
+    Stores journal pages for a division and moves its high-water mark.
+    :param owner_corp_id:
+    :param division:
+    :param pages: iterator of (page number, new journal rows) for the division, newest first.
+    :return: tuple of (number of inserted rows, number of skipped rows)
+    :raises NotModified: if the journal has not changed since the last sync.
+    """
+    inserted, skipped = _store_journal_pages(division, pages)
+    logger.info(
+        f"Journal for {owner_corp_id} division {division.division_id}: "
+        f"{inserted} entries inserted, {skipped} skipped."
+    )
+    _finish_division_journal(division)
+    return inserted, skipped
+
+
+def _start_backfill(owner, divisions):
+    """
+    Hands divisions whose journal was never synced over to the backfill, starting at their first page.
+    :param owner:
+    :param divisions: WalletDivisions of the owner.
+    :return:
+    """
+    WalletDivision.objects.filter(pk__in=[division.pk for division in divisions]).update(
+        backfill_page=1, backfill_pages=0
+    )
+    for division in divisions:
+        division.backfill_page = 1
+        division.backfill_pages = 0
+
+    started = now()
+    if not owner.backfill_running:
+        owner.backfill_started = started
+        owner.backfill_finished = None
+        owner.backfill_pages_done = 0
+        owner.backfill_pages_total = 0
+    owner.backfill_updated = started
+    owner.save(update_fields=[
+        "backfill_started", "backfill_finished", "backfill_updated", "backfill_pages_done", "backfill_pages_total"
+    ])
+    logger.info(f"Backfilling journal of {len(divisions)} divisions for {owner.corp.corporation_id}.")
+
+
+def _backfill_stalled(owner):
+    # A running backfill stores a page at least this often, even while its chunks are being retried.
+    stalled_after = 2 * WALLETINSIGHTS_SYNC_LOCK_TIMEOUT + WALLETINSIGHTS_BACKFILL_CHUNK_DELAY + BACKOFF_MAX
+    return owner.backfill_updated is None or owner.backfill_updated < now() - timedelta(seconds=stalled_after)
+
+
+def _finish_backfill(owner):
+    owner.backfill_finished = now()
+    owner.save(update_fields=["backfill_finished"])
+    owner.invalidate_dashboard_card()
+    logger.info(f"Journal backfill for {owner.corp.corporation_id} finished.")
+
+
+def _backfill_pages(owner_corp_id, division, token):
+    """
+    Yield the next chunk of journal pages of a division that is being backfilled, as (page number, entries).
+    Progress is recorded on the division and its owner once each page is stored, and backfill_page
+    is cleared once the last page of the division was stored.
+    :param owner_corp_id:
+    :param division:
+    :param token:
+    :return:
+    """
+    fetched = 0
+    for page, entries, pages in iter_journal_page_range(
+        owner_corp_id, division.division_id, token, division.backfill_page, WALLETINSIGHTS_BACKFILL_CHUNK_PAGES
+    ):
+        yield page, entries
+        # Every page reports the page count of the journal, which grows while the backfill runs.
+        Owner.objects.filter(pk=division.corp_id).update(
+            backfill_pages_done=F("backfill_pages_done") + 1,
+            backfill_pages_total=F("backfill_pages_total") + pages - division.backfill_pages,
+            backfill_updated=now()
+        )
+        division.backfill_page = page + 1
+        division.backfill_pages = pages
+        WalletDivision.objects.filter(pk=division.pk).update(backfill_page=page + 1, backfill_pages=pages)
+        fetched += 1
+    if fetched < WALLETINSIGHTS_BACKFILL_CHUNK_PAGES or division.backfill_page > division.backfill_pages:
+        division.backfill_page = None
+
+
+@shared_task(bind=True, **BULK_LANE)
+@track_sync
+@owner_locked("journal")
+def update_owner_journals(self, owner_corp_id, token_id=None):
     """
     Updates journal data for all divisions of a corp wallet.
+    Pages for every division are fetched concurrently under a single token.
     :param owner_corp_id:
     :param token_id:
     :return:
     """
-    if not token_id:
-        token = __get_least_recently_used_token(owner_corp_id)
-    else:
-        token = Token.objects.get(pk=token_id)
+    owner = _get_owner(owner_corp_id)
+    set_owner(owner)
+    token = _get_token(owner, token_id)
+    if token is None:
+        logger.warning(f"No valid token for {owner_corp_id}. Skipping.")
+        return
 
-    divisions = WalletDivision.objects.filter(corp__corp__corporation_id=owner_corp_id)
+    divisions = list(WalletDivision.objects.filter(corp=owner).select_related("corp"))
 
     if len(divisions) == 0:
         logger.warning(f"Divisions not loaded for {owner_corp_id}, run the division update task first, and try again!")
         return
 
-    for division in divisions:
-        update_owner_division_journal.delay(owner_corp_id, division.pk, token.pk)
+    if WALLETINSIGHTS_BACKFILL_CHUNK_PAGES:
+        # Journals that were never synced are imported in chunks by the backfill instead.
+        new = [d for d in divisions if d.backfill_page is None and d.journal_last_updated is None]
+        if new:
+            _start_backfill(owner, new)
+        backfilling = [d for d in divisions if d.backfill_page is not None]
+        if new or (backfilling and _backfill_stalled(owner)):
+            backfill_owner_journal.delay(owner_corp_id, token_id=token.pk)
+        divisions = [d for d in divisions if d.backfill_page is None]
+
+    totals = {"inserted": 0, "skipped": 0}
+    try:
+        for division, pages in iter_owner_journal_pages(owner_corp_id, divisions, token):
+            try:
+                inserted, skipped = _store_division_journal(owner_corp_id, division, pages)
+            except NotModified:
+                logger.debug(f"Journal for {owner_corp_id} division {division.division_id} unchanged.")
+                continue
+            totals["inserted"] += inserted
+            totals["skipped"] += skipped
+    except RETRY_ERRORS as e:
+        # Stored pages are kept and checkpointed, high-water marks only move for divisions that completed.
+        _retry_later(self, e, token)
+
+    update_ownerchar_last_used.delay(token.character_id)
+    return totals
 
 
-@shared_task()
-def update_owner_division_journal(owner_corp_id, division_pk, token_id=None):
+@shared_task(bind=True, **BULK_LANE)
+@track_sync
+@owner_locked("journal")
+def update_owner_division_journal(self, owner_corp_id, division_pk, token_id=None):
     """
     Updates journal data for a specific division
     :param owner_corp_id:
@@ -168,40 +486,149 @@ def update_owner_division_journal(owner_corp_id, division_pk, token_id=None):
     :param token_id:
     :return:
     """
-    if not token_id:
-        token = __get_least_recently_used_token(owner_corp_id)
-    else:
-        token = Token.objects.get(pk=token_id)
+    division = WalletDivision.objects.select_related("corp").get(pk=division_pk)
+    set_owner(division.corp)
+    token = _get_token(division.corp, token_id)
+    if token is None:
+        logger.warning(f"No valid token for {owner_corp_id}. Skipping.")
+        return
 
-    division = WalletDivision.objects.get(pk=division_pk)
+    try:
+        inserted, skipped = _store_division_journal(
+            owner_corp_id, division, iter_journal_pages(owner_corp_id, division, token)
+        )
+    except RETRY_ERRORS as e:
+        # Stored pages are kept and checkpointed, the high-water mark only moves once a run completes.
+        _retry_later(self, e, token)
+    except NotModified:
+        logger.debug(f"Journal for {owner_corp_id} division {division.division_id} unchanged.")
+        return {"inserted": 0, "skipped": 0}
 
-    entries = esi.client.Wallet.get_corporations_corporation_id_wallets_division_journal(
-        corporation_id=owner_corp_id,
-        division=division.division_id,
-        token=token.valid_access_token()
-    ).results()
+    update_ownerchar_last_used.delay(token.character_id)
+    return {"inserted": inserted, "skipped": skipped}
 
-    entry_ids = (
-        WalletJournalEntry.objects
-        .filter(division=division, date__gte=now()-timedelta(days=35))
-        .values_list("entry_id", flat=True)
+
+@shared_task(bind=True, **BULK_LANE)
+@track_sync
+@owner_locked("backfill")
+def backfill_owner_journal(self, owner_corp_id, token_id=None):
+    """
+    Imports the next chunk of journal pages for the first division of an owner that is being backfilled,
+    then queues itself for the next chunk. Pages are fetched one at a time and committed as they are stored,
+    and the pause between chunks is at least as long as the chunk took.
+    :param owner_corp_id:
+    :param token_id: default: None
+    :return: number of journal entries inserted.
+    """
+    owner = _get_owner(owner_corp_id)
+    set_owner(owner)
+    backfilling = WalletDivision.objects.filter(corp=owner, backfill_page__isnull=False)
+    division = backfilling.select_related("corp").order_by("division_id").first()
+    if division is None:
+        if owner.backfill_running:
+            _finish_backfill(owner)
+        return 0
+    token = _get_token(owner, token_id)
+    if token is None:
+        logger.warning(f"No valid token for {owner_corp_id}. Skipping.")
+        return 0
+
+    start = time.perf_counter()
+    try:
+        inserted, skipped = _store_journal_pages(division, _backfill_pages(owner_corp_id, division, token))
+    except RETRY_ERRORS as e:
+        # Stored pages are kept, the retry continues at the first page that was not stored.
+        _retry_later(self, e, token)
+    logger.info(
+        f"Backfill for {owner_corp_id} division {division.division_id}: "
+        f"{inserted} entries inserted, {skipped} skipped."
     )
+    if division.backfill_page is None:
+        _finish_division_journal(division)
+    update_ownerchar_last_used.delay(token.character_id)
 
-    for entry in entries:
-        entry_id = entry.pop("id")
-        if entry_id not in entry_ids:
-            WalletJournalEntry.objects.create(
-                division=division,
-                entry_id=entry_id,
-                **entry
-            )
+    if backfilling.exists():
+        countdown = max(WALLETINSIGHTS_BACKFILL_CHUNK_DELAY, int(time.perf_counter() - start), 1)
+        backfill_owner_journal.apply_async(args=[owner_corp_id], kwargs={"token_id": token.pk}, countdown=countdown)
+        owner.invalidate_dashboard_card()
+    else:
+        _finish_backfill(owner)
+    return inserted
 
-    division.journal_last_updated = now()
-    division.save()
-    update_ownerchar_last_used.delay(token.character_id)
+
+@shared_task(bind=True, **BULK_LANE)
+@track_sync
+def resolve_names(self, ids):
+    """
+    Resolves ids found in the journal to names and stores them in the local name table.
+    Ids with a current name are skipped, so a retried run only resolves what is left.
+    :param ids: list of ids.
+    :return: number of names stored.
+    """
+    ids = sorted(EveName.objects.stale_ids(ids, WALLETINSIGHTS_NAME_TTL))
+    stored = 0
+    for i in range(0, len(ids), NAMES_BATCH_SIZE):
+        try:
+            names, unknown = fetch_names(ids[i:i + NAMES_BATCH_SIZE])
+        except RETRY_ERRORS as e:
+            _retry_later(self, e)
+        # Unknown ids are stored without a name, so they are only retried once the name TTL passes.
+        names += [{"id": id_, "name": "", "category": "unknown"} for id_ in unknown]
+        EveName.objects.store(names)
+        stored += len(names)
+    return stored
+
+
+@shared_task(**FAST_LANE)
+@track_sync
+def send_outflow_alerts(division_pk, entry_ids):
+    """
+    Notifies users about unusual outflows found while syncing a division's journal.
+    :param division_pk:
+    :param entry_ids: journal entry ids of the unusual outflows.
+    :return: number of users notified.
+    """
+    division = WalletDivision.objects.select_related("corp__corp").get(pk=division_pk)
+    entries = list(WalletJournalEntry.objects.filter(division=division, entry_id__in=entry_ids).order_by("-date"))
+    logger.warning(
+        f"{len(entries)} unusual outflows from {division.corp.corp.corporation_id} division {division.division_id}."
+    )
+    return notify_outflows(division, entries)
 
 
-@shared_task()
+@shared_task(**FAST_LANE)
+@track_sync
 def update_ownerchar_last_used(character_id):
     OwnerCharacter.objects.filter(character__character_id=character_id).update(last_used=now())
     return
+
+
+@shared_task(**BULK_LANE)
+@track_sync
+def archive_journal_entries():
+    """
+    Moves journal entries older than the retention period into the archive table.
+    :return:
+    """
+    if WALLETINSIGHTS_JOURNAL_RETENTION_DAYS is None:
+        return
+    retention_days = max(WALLETINSIGHTS_JOURNAL_RETENTION_DAYS, MIN_JOURNAL_RETENTION_DAYS)
+    archived = WalletJournalEntry.objects.archive_older_than(now() - timedelta(days=retention_days))
+    logger.info(f"Archived {archived} journal entries older than {retention_days} days.")
+    return archived
+
+
+@shared_task(**BULK_LANE)
+@track_sync
+def compact_balance_records():
+    """
+    Downsamples old balance records to one record per division and day.
+    :return:
+    """
+    if WALLETINSIGHTS_BALANCE_COMPACT_AFTER_DAYS is None:
+        return
+    deleted = WalletBalanceRecord.objects.compact_before(
+        now() - timedelta(days=WALLETINSIGHTS_BALANCE_COMPACT_AFTER_DAYS)
+    )
+    logger.info(f"Compacted balance history, {deleted} records removed.")
+    return deleted
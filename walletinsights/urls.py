@@ -7,4 +7,11 @@ app_name = "walletinsights"
 urlpatterns = [
     re_path(r"^$", views.dashboard, name="dashboard"),
     re_path(r"^add_owner/$", views.add_owner, name="add_character"),
+    re_path(r"^analytics/$", views.analytics, name="analytics"),
+    re_path(r"^journal/$", views.journal, name="journal"),
+    re_path(r"^api/journal/$", views.journal_api, name="journal_api"),
+    re_path(r"^export/journal/$", views.export_journal, name="export_journal"),
+    re_path(r"^metrics/$", views.metrics, name="metrics"),
+    re_path(r"^api/balances/(?P<corporation_id>\d+)/$", views.balance_history, name="balance_history"),
+    re_path(r"^api/cashflow/(?P<corporation_id>\d+)/$", views.cashflow_api, name="cashflow"),
 ]
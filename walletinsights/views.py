@@ -1,46 +1,111 @@
-from django.shortcuts import render, redirect
+from datetime import timedelta
+
+from django.db.models import Sum
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render, redirect
 from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib import messages
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.utils.crypto import constant_time_compare
+from django.utils.timezone import localdate, now
 from django.utils.translation import gettext_lazy as _
 from esi.decorators import token_required
 from allianceauth.eveonline.models import EveCharacter
 from allianceauth.services.hooks import get_extension_logger
 
+from .analytics import cashflow_forecast, monthly_pnl, moving_averages
+from .app_settings import WALLETINSIGHTS_DASHBOARD_CACHE_TTL, WALLETINSIGHTS_METRICS_TOKEN
+from .exports import iter_csv_lines, journal_export_queryset
+from .forms import DateRangeForm, JournalBrowseForm, JournalFilterForm
+from .journal import PAGE_SIZE, InvalidCursor, journal_page
+from .metrics import COUNTERS, TIMERS
 from .providers import REQUIRED_SCOPES
-from .models import Owner, OwnerCharacter
-from .tasks import update_owner
+from .reports import ref_type_breakdown
+from .models import (
+    DASHBOARD_CARD_DATA_PREFIX, EveName, Owner, OwnerCharacter, OwnerSyncStats, RefType, WalletBalanceRecord,
+    WalletDivision, WalletJournalDailyRollup
+)
+from .tasks import queue_owner_update
 
 
 logger = get_extension_logger(__name__)
 
+# Longest balance history served, and longest range that can be split into hourly buckets.
+BALANCE_HISTORY_MAX_DAYS = 365
+HOURLY_BUCKET_MAX_DAYS = 31
+
+
+def _can_view_corp(user, corporation_id):
+    """
+    Users can see their main's corp, or every corp with all_corp_access.
+    """
+    return (
+        user.has_perm("walletinsights.all_corp_access")
+        or user.profile.main_character.corporation_id == corporation_id
+    )
+
+
+def _add_card_data(owners):
+    """
+    Sets the master wallet balance and 30 day cash flow shown on the dashboard card of each owner.
+    The values are cached per owner and dropped together with the rendered card, so only owners
+    whose card was invalidated are queried.
+    :param owners:
+    :return:
+    """
+    keys = {owner.pk: f"{DASHBOARD_CARD_DATA_PREFIX}:{owner.pk}" for owner in owners}
+    cards = cache.get_many(keys.values())
+    stale = [pk for pk, key in keys.items() if key not in cards]
+    if stale:
+        balances = dict(
+            WalletDivision.objects.filter(corp_id__in=stale, division_id=1).values_list("corp_id", "balance")
+        )
+        # Cash flow totals are read from the daily rollups, so this is bounded by days rather than journal rows.
+        flows = {
+            row["division__corp"]: row
+            for row in (
+                WalletJournalDailyRollup.objects
+                .filter(division__corp__in=stale, day__gte=localdate() - timedelta(days=30))
+                .values("division__corp")
+                .annotate(income=Sum("income"), expense=Sum("expense"))
+                .order_by()
+            )
+        }
+        fresh = {
+            keys[pk]: {
+                "master_wallet_balance": balances.get(pk),
+                "income_30d": flows.get(pk, {}).get("income") or 0,
+                "expense_30d": flows.get(pk, {}).get("expense") or 0,
+            }
+            for pk in stale
+        }
+        cache.set_many(fresh, timeout=WALLETINSIGHTS_DASHBOARD_CACHE_TTL)
+        cards.update(fresh)
+    for owner in owners:
+        for name, value in cards[keys[owner.pk]].items():
+            setattr(owner, name, value)
+
 
 @login_required()
 @permission_required("walletinsights.access_walletinsights")
 def dashboard(request):
     main_corp_id = request.user.profile.main_character.corporation_id
-    select_criteria = {
-        "master_division_id": (
-            "SELECT id FROM walletinsights_walletdivision "
-            "WHERE walletinsights_walletdivision.corp_id = walletinsights_owner.id "
-            "AND walletinsights_walletdivision.division_id = 1"
-        ),
-        "master_wallet_balance": (
-            "SELECT balance FROM walletinsights_walletbalancerecord "
-            "WHERE walletinsights_walletbalancerecord.division_id = master_division_id "
-            "ORDER BY time DESC LIMIT 1"
-        )
-    }
+    all_owners = Owner.objects.select_related("corp")
 
-    main_owner = Owner.objects.filter(corp__corporation_id=main_corp_id).extra(select=select_criteria).first()
+    main_owner = all_owners.filter(corp__corporation_id=main_corp_id).first()
 
     if request.user.has_perm("walletinsights.all_corp_access"):
-        owners = Owner.objects.all().exclude(corp__corporation_id=main_corp_id).extra(select=select_criteria)
+        owners = list(all_owners.exclude(corp__corporation_id=main_corp_id))
     else:
-        owners = Owner.objects.none()
+        owners = []
+
+    _add_card_data([owner for owner in [main_owner, *owners] if owner])
 
     ctx = {
         'main_corp': main_owner,
         "owners": owners,
+        "card_cache_ttl": WALLETINSIGHTS_DASHBOARD_CACHE_TTL,
     }
     return render(request, 'walletinsights/dash.html', ctx)
 
@@ -66,7 +131,7 @@ def add_owner(request, token):
         )
         o.save()
         if owner_created:
-            update_owner.delay(owner.corp.corporation_id)
+            queue_owner_update(owner.corp.corporation_id)
             messages.success(request, _("Success! Owner added."))
         else:
             messages.success(request, _("Owner character added!"))
@@ -78,4 +143,318 @@ def add_owner(request, token):
         messages.success(request, _("Success! Existing owner character reactivated."))
     else:
         messages.info(request, _("Owner character already exists."))
-    return redirect("walletinsights:dashboard")
\ No newline at end of file
+    return redirect("walletinsights:dashboard")
+
+
+@login_required()
+@permission_required("walletinsights.access_walletinsights")
+def export_journal(request):
+    """
+    Streams the journal entries of an owner as csv.
+    :param request:
+    :return:
+    """
+    form = JournalFilterForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+    filters = form.cleaned_data
+    if not _can_view_corp(request.user, filters["corporation_id"]):
+        raise PermissionDenied
+
+    response = StreamingHttpResponse(iter_csv_lines(_filtered_journal(filters)), content_type="text/csv")
+    response["Content-Disposition"] = f'attachment; filename="journal_{filters["corporation_id"]}.csv"'
+    return response
+
+
+def _filtered_journal(filters):
+    return journal_export_queryset(
+        corporation_id=filters["corporation_id"],
+        division_id=filters["division"],
+        start=filters["start"],
+        end=filters["end"],
+        ref_types=filters["ref_type"],
+        party_id=filters["party_id"],
+        min_amount=filters["min_amount"],
+        max_amount=filters["max_amount"],
+    )
+
+
+def _add_names(entries):
+    names = EveName.objects.names_for(
+        party_id for entry in entries for party_id in (entry.first_party_id, entry.second_party_id)
+    )
+    for entry in entries:
+        entry.ref_type_name = RefType.objects.name_for(entry.ref_type_id)
+        entry.first_party_name = names.get(entry.first_party_id)
+        entry.second_party_name = names.get(entry.second_party_id)
+
+
+@login_required()
+@permission_required("walletinsights.access_walletinsights")
+def journal(request):
+    """
+    Browse the journal entries of an owner.
+    :param request:
+    :return:
+    """
+    data = request.GET.copy()
+    data.setdefault("corporation_id", request.user.profile.main_character.corporation_id)
+    form = JournalBrowseForm(data)
+    entries, next_cursor = [], None
+    if form.is_valid():
+        filters = form.cleaned_data
+        if not _can_view_corp(request.user, filters["corporation_id"]):
+            raise PermissionDenied
+        try:
+            entries, next_cursor = journal_page(
+                _filtered_journal(filters).select_related("division"),
+                after=filters["after"],
+                limit=filters["limit"] or PAGE_SIZE,
+            )
+        except InvalidCursor:
+            return HttpResponseBadRequest("Invalid cursor.")
+        _add_names(entries)
+
+    if request.user.has_perm("walletinsights.all_corp_access"):
+        owners = Owner.objects.select_related("corp").order_by("corp__corporation_name")
+    else:
+        owners = Owner.objects.select_related("corp").filter(
+            corp__corporation_id=request.user.profile.main_character.corporation_id
+        )
+
+    next_query = None
+    if next_cursor:
+        next_params = data.copy()
+        next_params["after"] = next_cursor
+        next_query = next_params.urlencode()
+    export_params = data.copy()
+    export_params.pop("after", None)
+    export_params.pop("limit", None)
+
+    ctx = {
+        "form": form,
+        "owners": owners,
+        "entries": entries,
+        "next_query": next_query,
+        "export_query": export_params.urlencode(),
+    }
+    return render(request, "walletinsights/journal.html", ctx)
+
+
+@login_required()
+@permission_required("walletinsights.access_walletinsights")
+def journal_api(request):
+    """
+    One page of journal entries as JSON. Pass the returned next cursor as after to get the next page.
+    :param request:
+    :return:
+    """
+    form = JournalBrowseForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({"errors": form.errors}, status=400)
+    filters = form.cleaned_data
+    if not _can_view_corp(request.user, filters["corporation_id"]):
+        raise PermissionDenied
+    try:
+        entries, next_cursor = journal_page(
+            _filtered_journal(filters).select_related("division"),
+            after=filters["after"],
+            limit=filters["limit"] or PAGE_SIZE,
+        )
+    except InvalidCursor:
+        return JsonResponse({"errors": {"after": ["Invalid cursor."]}}, status=400)
+    _add_names(entries)
+
+    return JsonResponse({
+        "entries": [
+            {
+                "entry_id": entry.entry_id,
+                "division": entry.division.division_id,
+                "date": entry.date.isoformat(),
+                "ref_type": entry.ref_type_name,
+                "amount": float(entry.amount) if entry.amount is not None else None,
+                "balance": float(entry.balance) if entry.balance is not None else None,
+                "tax": float(entry.tax) if entry.tax is not None else None,
+                "first_party_id": entry.first_party_id,
+                "second_party_id": entry.second_party_id,
+                "first_party_name": entry.first_party_name,
+                "second_party_name": entry.second_party_name,
+                "description": entry.description,
+                "reason": entry.reason,
+            }
+            for entry in entries
+        ],
+        "next": next_cursor,
+    })
+
+
+def metrics(request):
+    """
+    Prometheus exposition of the last sync stats of every owner.
+    Requires WALLETINSIGHTS_METRICS_TOKEN to be set and sent as a bearer token.
+    :param request:
+    :return:
+    """
+    if not WALLETINSIGHTS_METRICS_TOKEN or not constant_time_compare(
+        request.headers.get("Authorization", ""), f"Bearer {WALLETINSIGHTS_METRICS_TOKEN}"
+    ):
+        raise Http404
+
+    stats = list(OwnerSyncStats.objects.select_related("owner__corp"))
+    lines = []
+    for field in ("duration", *COUNTERS, *TIMERS):
+        name = f"walletinsights_last_sync_{field}"
+        lines.append(f"# TYPE {name} gauge")
+        for stat in stats:
+            labels = f'corporation_id="{stat.owner.corp.corporation_id}",task="{stat.task}"'
+            lines.append(f"{name}{{{labels}}} {getattr(stat, field)}")
+    lines.append("# TYPE walletinsights_last_sync_timestamp_seconds gauge")
+    for stat in stats:
+        labels = f'corporation_id="{stat.owner.corp.corporation_id}",task="{stat.task}"'
+        lines.append(f"walletinsights_last_sync_timestamp_seconds{{{labels}}} {stat.last_run.timestamp()}")
+    return HttpResponse("\n".join(lines) + "\n", content_type="text/plain; version=0.0.4")
+
+
+@login_required()
+@permission_required("walletinsights.access_walletinsights")
+def balance_history(request, corporation_id):
+    """
+    Balance history of an owner's divisions, downsampled in the database.
+    Query parameters: days (1-365, default 30), bucket (hour, day or week, picked from days by default,
+    hour for at most 31 days) and division (1-7, all divisions by default).
+    :param request:
+    :param corporation_id:
+    :return:
+    """
+    corporation_id = int(corporation_id)
+    if not _can_view_corp(request.user, corporation_id):
+        raise PermissionDenied
+    owner = get_object_or_404(Owner, corp__corporation_id=corporation_id)
+
+    try:
+        days = int(request.GET.get("days", 30))
+        division_id = int(request.GET["division"]) if request.GET.get("division") else None
+    except ValueError:
+        return HttpResponseBadRequest("days and division must be numbers.")
+    days = min(max(days, 1), BALANCE_HISTORY_MAX_DAYS)
+    bucket = request.GET.get("bucket") or ("hour" if days <= 7 else "day" if days <= 90 else "week")
+    if bucket not in WalletBalanceRecord.objects.BUCKETS:
+        return HttpResponseBadRequest("bucket must be one of hour, day or week.")
+    if bucket == "hour" and days > HOURLY_BUCKET_MAX_DAYS:
+        return HttpResponseBadRequest(f"hourly buckets cover at most {HOURLY_BUCKET_MAX_DAYS} days.")
+
+    divisions = WalletDivision.objects.filter(corp=owner)
+    if division_id is not None:
+        divisions = divisions.filter(division_id=division_id)
+    series = WalletBalanceRecord.objects.bucketed(divisions, now() - timedelta(days=days), bucket)
+
+    return JsonResponse({
+        "corporation_id": corporation_id,
+        "bucket": bucket,
+        "series": {
+            division: [
+                {
+                    "time": point["time"].isoformat(),
+                    "min": float(point["min"]),
+                    "max": float(point["max"]),
+                    "last": float(point["last"]) if point["last"] is not None else None,
+                }
+                for point in points
+            ]
+            for division, points in series.items()
+        },
+    })
+
+
+@login_required()
+@permission_required("walletinsights.access_walletinsights")
+@permission_required("walletinsights.all_corp_access")
+def analytics(request):
+    """
+    Compares income and expenses by ref type across every owner.
+    :param request:
+    :return:
+    """
+    form = DateRangeForm(request.GET or None)
+    end = localdate()
+    start = end - timedelta(days=30)
+    if form.is_valid():
+        start = form.cleaned_data["start"] or start
+        end = form.cleaned_data["end"] or end
+
+    owners = list(Owner.objects.select_related("corp").order_by("corp__corporation_name"))
+    breakdown = ref_type_breakdown(owners, start, end)
+
+    ref_types = sorted({ref_type for totals in breakdown.values() for ref_type in totals})
+    rows = [
+        {
+            "ref_type": ref_type,
+            "nets": [breakdown.get(owner.pk, {}).get(ref_type, {}).get("net") for owner in owners],
+        }
+        for ref_type in ref_types
+    ]
+    totals = [
+        {
+            "income": sum(t["income"] for t in breakdown.get(owner.pk, {}).values()),
+            "expense": sum(t["expense"] for t in breakdown.get(owner.pk, {}).values()),
+        }
+        for owner in owners
+    ]
+
+    ctx = {
+        "form": form,
+        "start": start,
+        "end": end,
+        "owners": owners,
+        "rows": rows,
+        "totals": totals,
+    }
+    return render(request, "walletinsights/analytics.html", ctx)
+
+
+@login_required()
+@permission_required("walletinsights.access_walletinsights")
+def cashflow_api(request, corporation_id):
+    """
+    Monthly P&L, daily net flow with its moving average, and a cash flow forecast of an owner.
+    Query parameters: start and end (the last year by default), window (moving average days, default 30)
+    and forecast (days to project, default 30).
+    Requires numpy and pandas, install with walletinsights[analytics].
+    :param request:
+    :param corporation_id:
+    :return:
+    """
+    corporation_id = int(corporation_id)
+    if not _can_view_corp(request.user, corporation_id):
+        raise PermissionDenied
+    owner = get_object_or_404(Owner, corp__corporation_id=corporation_id)
+
+    form = DateRangeForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+    try:
+        window = int(request.GET.get("window", 30))
+        forecast_days = int(request.GET.get("forecast", 30))
+    except ValueError:
+        return HttpResponseBadRequest("window and forecast must be numbers.")
+    if not 1 <= window <= 365 or not 1 <= forecast_days <= 365:
+        return HttpResponseBadRequest("window and forecast must be between 1 and 365.")
+    end = form.cleaned_data["end"] or localdate()
+    start = form.cleaned_data["start"] or end - timedelta(days=364)
+
+    try:
+        pnl = monthly_pnl(owner, start, end)
+        averages = moving_averages(owner, start, end, window)
+        forecast = cashflow_forecast(owner, forecast_days)
+    except ImportError:
+        return HttpResponse(
+            "Cash flow analytics require numpy and pandas, install walletinsights[analytics].",
+            status=501
+        )
+
+    return JsonResponse({
+        "corporation_id": corporation_id,
+        "monthly": [{**row, "month": row["month"].isoformat()} for row in pnl],
+        "daily": [{**row, "day": row["day"].isoformat()} for row in averages],
+        "forecast": [{**row, "day": row["day"].isoformat()} for row in forecast],
+    })